@@ -6,7 +6,7 @@ Copyright (C) 2002-2010 Stuart Rackham. Free use of this software is granted
 under the terms of the GNU General Public License (GPL).
 """
 
-import sys, os, re, time, traceback, tempfile, subprocess, codecs, locale, unicodedata, copy
+import sys, os, re, time, traceback, tempfile, subprocess, codecs, locale, unicodedata, copy, keyword, pickle
 
 ### Used by asciidocapi.py ###
 VERSION = '8.6.9'           # See CHANGLOG file for version history.
@@ -30,6 +30,7 @@ SUBS_VERBATIM = ('specialcharacters','callouts')
 
 NAME_RE = r'(?u)[^\W\d][-\w]*'  # Valid section or attribute name.
 OR, AND = ',', '+'              # Attribute list separators.
+PY_LITERAL_NAMES = ('None','True','False')  # Python constant names.
 
 
 #---------------------------------------------------------------------------
@@ -106,24 +107,85 @@ class AttrDict(dict):
     def __setstate__(self,value):
         for k,v in value.items(): self[k]=v
 
-class InsensitiveDict(dict):
+class AttributeDict(dict):
     """
-    Like a dictionary except key access is case insensitive.
-    Keys are stored in lower case.
+    Document attributes dictionary.
+    Like a dictionary except key access is case insensitive. Keys are
+    converted to lower case and interned once and the conversions are
+    remembered so repeated lookups of the same name are cheap.
+    The version number is incremented each time the dictionary is modified so
+    results derived from the attributes can be cached. The subs_version number
+    is not incremented by the BOOKKEEPING attributes that are rewritten for
+    each block and list item, it is used to cache inline substitutions.
     """
+    names = {}      # Key is attribute name, value is normalized name.
+    version = 0
+    subs_version = 0
+    BOOKKEEPING = ('blockname','listindex')
+    @staticmethod
+    def normalize(key):
+        result = AttributeDict.names.get(key)
+        if result is None:
+            result = key.lower()
+            if type(result) is str:
+                result = intern(result)
+            AttributeDict.names[key] = result
+        return result
+    # Stored keys are lower case so lookups try the key as given first and
+    # only normalize it on a miss if it is not lower case.
     def __getitem__(self, key):
-        return dict.__getitem__(self, key.lower())
+        try:
+            return dict.__getitem__(self, key)
+        except KeyError:
+            return dict.__getitem__(self, self.normalize(key))
     def __setitem__(self, key, value):
-        dict.__setitem__(self, key.lower(), value)
+        key = self.normalize(key)
+        old = dict.get(self, key, self)
+        if old is not self and type(old) is type(value) and old == value:
+            return  # Unchanged so cached results are still valid.
+        dict.__setitem__(self, key, value)
+        self.version += 1
+        if key not in self.BOOKKEEPING:
+            self.subs_version += 1
+    def __delitem__(self, key):
+        dict.__delitem__(self, self.normalize(key))
+        self.version += 1
+        self.subs_version += 1
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (not key.islower() and
+                dict.__contains__(self, self.normalize(key)))
     def has_key(self, key):
-        return dict.has_key(self,key.lower())
+        return self.__contains__(key)
     def get(self, key, default=None):
-        return dict.get(self, key.lower(), default)
+        result = dict.get(self, key, default)
+        if result is default and not key.islower():
+            result = dict.get(self, self.normalize(key), default)
+        return result
     def update(self, dict):
         for k,v in dict.items():
             self[k] = v
     def setdefault(self, key, default = None):
-        return dict.setdefault(self, key.lower(), default)
+        self.version += 1
+        self.subs_version += 1
+        return dict.setdefault(self, self.normalize(key), default)
+    def pop(self, key, *default):
+        self.version += 1
+        self.subs_version += 1
+        return dict.pop(self, self.normalize(key), *default)
+    def clear(self):
+        dict.clear(self)
+        self.version += 1
+        self.subs_version += 1
+    def unnumbered(self):
+        """Return a new dictionary containing all attributes except the
+        numbered (positional) attributes."""
+        if getattr(self, '_unnumbered_version', None) != self.version:
+            self._unnumbered = {}
+            for k,v in self.items():
+                if not k.isdigit():
+                    self._unnumbered[k] = v
+            self._unnumbered_version = self.version
+        return self._unnumbered.copy()
 
 
 class Trace(object):
@@ -192,8 +254,8 @@ class Message:
             msg = self.format(msg,linenos=linenos)
             self.stderr(msg)
 
-    def warning(self, msg,linenos=True,offset=0):
-        msg = self.format(msg,'WARNING: ',linenos,offset=offset)
+    def warning(self, msg,linenos=True,offset=0,cursor=None):
+        msg = self.format(msg,'WARNING: ',linenos,cursor=cursor,offset=offset)
         document.has_warnings = True
         self.stderr(msg)
 
@@ -307,6 +369,35 @@ def is_re(s):
     except: return False
     else: return True
 
+def re_terminators(patterns):
+    """Combine list of regular expression 'patterns' into a list of compiled
+    regular expressions, a line is terminated if any of them match it.
+    Patterns that share the same flags are joined into a single alternation.
+    Inline flags apply to a whole pattern so patterns with different flags
+    (e.g. the (?u) attribute list pattern) are combined separately. Patterns
+    that cannot be combined safely (backreferences, too many groups) are
+    compiled separately."""
+    result = []
+    runs = []       # Lists of patterns with the same flags.
+    flags = []
+    for p in patterns:
+        reo = re.compile(p)
+        if re.search(r'\\\d',p):
+            result.append(reo)  # Group numbers would change if combined.
+        elif reo.flags in flags:
+            runs[flags.index(reo.flags)].append(p)
+        else:
+            flags.append(reo.flags)
+            runs.append([p])
+    for run in runs:
+        # Delete named groups to avoid ambiguity.
+        relist = ['(?:%s)' % re.sub(r'\?P<\S+?>','',p) for p in run]
+        try:
+            result.append(re.compile('|'.join(relist)))
+        except (re.error,AssertionError):
+            result += [re.compile(p) for p in run]
+    return result
+
 def re_join(relist):
     """Join list of regular expressions re1,re2,... to single regular
     expression (re1)|(re2)|..."""
@@ -320,6 +411,44 @@ def re_join(relist):
     result = '('+result+')'
     return result
 
+def re_literals(s):
+    """Return a tuple of literal strings, one of which must occur in any match
+    of regular expression s. Return None if no such strings can be found."""
+    import sre_parse, sre_constants as sc
+    def literals(p):
+        candidates = []
+        run = ''
+        for op,av in p:
+            if op == sc.LITERAL:
+                run += chr(av)
+                continue
+            if run:
+                candidates.append((run,))
+                run = ''
+            if op == sc.SUBPATTERN:
+                candidates.append(literals(av[-1]))
+            elif op in (sc.MAX_REPEAT,sc.MIN_REPEAT) and av[0] > 0:
+                candidates.append(literals(av[2]))
+            elif op == sc.BRANCH:
+                alternatives = [literals(b) for b in av[1]]
+                if None not in alternatives:
+                    candidates.append(sum(alternatives,()))
+        if run:
+            candidates.append((run,))
+        candidates = [c for c in candidates if c]
+        if not candidates:
+            return None
+        # The candidate with the longest shortest string is most selective.
+        candidates.sort(key=lambda c: (min(map(len,c)),-len(c)))
+        return candidates[-1]
+    try:
+        p = sre_parse.parse(s)
+        if p.pattern.flags & sc.SRE_FLAG_IGNORECASE:
+            return None
+        return literals(p)
+    except Exception:
+        return None
+
 def lstrip_list(s):
     """
     Return list with empty items from start of list removed.
@@ -489,18 +618,84 @@ def parse_attributes(attrs,dict):
     attrs: '"hello", planet="earth"'
     dict: {'planet': 'earth', '0': '"hello",planet="earth"', '1': 'hello'}
     """
-    def f(*args,**keywords):
-        # Name and add aguments '1','2'... to keywords.
-        for i in range(len(args)):
-            if not str(i+1) in keywords:
-                keywords[str(i+1)] = args[i]
-        return keywords
-
     if not attrs:
         return
     dict['0'] = attrs
-    # Replace line separators with spaces so line spanning works.
-    s = re.sub(r'\s', ' ', attrs)
+    if attrs in attributes_cache:
+        d = attributes_cache[attrs]
+    else:
+        # Replace line separators with spaces so line spanning works.
+        s = re.sub(r'\s', ' ', attrs)
+        d = scan_attributes(s)
+        if d is None:
+            d = eval_attributes(s)
+        if len(attributes_cache) >= 1000:
+            attributes_cache.clear()
+        attributes_cache[attrs] = d
+    if d is None:
+        return  # If there's a syntax error leave with {0}=attrs.
+    dict.update(d)
+    assert len(d) > 0
+
+attributes_cache = {}   # Key is attribute list, value is parsed attributes.
+
+def scan_attributes(s):
+    """Fast path for parse_attributes() that handles the common attribute
+    list forms without invoking the Python parser: lists of unquoted values
+    and lists of quoted values followed by name="value" pairs. Return the
+    parsed attributes dictionary or None if 's' is not a simple list."""
+    if '\\' in s or '\0' in s:
+        return None
+    if '"' not in s and "'" not in s:
+        # A list of unquoted values, it only parses as Python expressions if
+        # it contains no identifiers (e.g. numbers).
+        items = [x.strip() for x in s.split(',')]
+        for x in items:
+            if re.match(r'^[A-Za-z_]\w*$', x) and x not in PY_LITERAL_NAMES:
+                break
+        else:
+            return None
+        d = {}
+        for i,x in enumerate(items):
+            if x:   # Drop empty positional arguments.
+                d[str(i+1)] = x
+        return d
+    reo = re.compile(r'\s*(?:(?P<name>[A-Za-z_]\w*)\s*=\s*)?'
+                     r'("(?P<dq>[^"]*)"|\'(?P<sq>[^\']*)\')\s*(?P<sep>,|$)')
+    d = {}
+    pos = 0
+    i = 1
+    keywords = False
+    while pos < len(s):
+        mo = reo.match(s,pos)
+        if not mo:
+            return None
+        name = mo.group('name')
+        value = mo.group('dq')
+        if value is None:
+            value = mo.group('sq')
+        if name is None:
+            if keywords:
+                return None     # Positional value after keyword.
+            d[str(i)] = value
+            i += 1
+        else:
+            if name in d or keyword.iskeyword(name) \
+                    or name in PY_LITERAL_NAMES:
+                return None
+            d[name] = value
+            keywords = True
+        pos = mo.end()
+        if mo.group('sep') == ',' and s[pos:].strip() == '':
+            break   # Trailing comma.
+    if not d:
+        return None
+    return d
+
+def eval_attributes(s):
+    """Parse attribute list 's' as Python function arguments (see
+    parse_attributes()). Return the parsed attributes dictionary or None if
+    there's a syntax error."""
     d = {}
     try:
         d.update(get_args(s))
@@ -518,11 +713,10 @@ def parse_attributes(attrs,dict):
             d.update(get_args(s))
             d.update(get_kwargs(s))
         except Exception:
-            return  # If there's a syntax error leave with {0}=attrs.
+            return None
         for k in d.keys():  # Drop any empty positional arguments.
             if d[k] == '': del d[k]
-    dict.update(d)
-    assert len(d) > 0
+    return d
 
 def parse_named_attributes(s,attrs):
     """Update a attrs dictionary with name="value" attributes from the s string.
@@ -834,6 +1028,50 @@ def filter_lines(filter_cmd, lines, attrs={}):
         message.warning('no output from filter: %s' % filter_cmd)
     return result
 
+def shell(cmd, stderr=None, timeout=None):
+    """Execute shell command 'cmd' and return an (output,status) tuple where
+    output is the command's stdout. If 'timeout' (seconds) is specified and
+    the command has not finished by then it is killed and status is None
+    (ignored on non-POSIX systems with Python older than 2.6)."""
+    if timeout and os.name != 'posix' and not hasattr(subprocess.Popen,'kill'):
+        timeout = None  # Popen.kill() requires Python 2.6.
+    if not timeout:
+        # os.popen() forks from C which is much cheaper than subprocess.
+        if stderr == subprocess.STDOUT:
+            cmd += ' 2>&1'
+        f = os.popen(cmd)
+        try:
+            output = f.read()
+        finally:
+            status = f.close()
+        return (output, status or 0)
+    import threading, signal
+    kwargs = {}
+    if os.name == 'posix':
+        # Run in a new process group so the shell's children are killed too.
+        kwargs['preexec_fn'] = os.setsid
+    p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+            stderr=stderr, **kwargs)
+    killed = []
+    def kill():
+        try:
+            if os.name == 'posix':
+                os.killpg(p.pid, signal.SIGKILL)
+            else:
+                p.kill()
+        except Exception:
+            return  # Already finished.
+        killed.append(True)
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        output = p.communicate()[0]
+    finally:
+        timer.cancel()
+    if killed:
+        return (output, None)
+    return (output, p.returncode)
+
 def system(name, args, is_macro=False, attrs=None):
     """
     Evaluate a system attribute ({name:args}) or system block macro
@@ -868,10 +1106,12 @@ def system(name, args, is_macro=False, attrs=None):
     if safe() and name not in ('include','include1'):
         message.unsafe(syntax)
         return None
-    result = None
-    if name in ('eval','eval3'):
+    result = syscache.get(name,args,separator)
+    if result is not None:
+        message.verbose('cached: %s' % syntax)
+    elif name in ('eval','eval3'):
         try:
-            result = eval(args)
+            result = eval(syscache.compile(args))
             if result is True:
                 result = ''
             elif result is False:
@@ -882,36 +1122,39 @@ def system(name, args, is_macro=False, attrs=None):
             message.warning('%s: evaluation error' % syntax)
     elif name in ('sys','sys2','sys3'):
         result = ''
-        fd,tmp = tempfile.mkstemp()
-        os.close(fd)
-        try:
-            cmd = args
-            cmd = cmd + (' > "%s"' % tmp)
-            if name == 'sys2':
-                cmd = cmd + ' 2>&1'
-            if os.name == 'nt':
-                # Remove redundant quoting -- this is not just
-                # cosmetic, unnecessary quoting appears to cause
-                # command line truncation.
-                cmd = re.sub(r'"([^ ]+?)"', r'\1', cmd)
-            message.verbose('shelling: %s' % cmd)
-            if os.system(cmd):
-                message.warning('%s: non-zero exit status' % syntax)
+        cmd = args
+        if os.name == 'nt':
+            # Remove redundant quoting -- this is not just
+            # cosmetic, unnecessary quoting appears to cause
+            # command line truncation.
+            cmd = re.sub(r'"([^ ]+?)"', r'\1', cmd)
+        message.verbose('shelling: %s' % cmd)
+        if name == 'sys2':
+            stderr = subprocess.STDOUT
+        else:
+            stderr = None
+        timeout = document.attributes.get('sys-timeout')
+        if timeout:
             try:
-                if os.path.isfile(tmp):
-                    f = open(tmp)
-                    try:
-                        lines = [s.rstrip() for s in f]
-                    finally:
-                        f.close()
-                else:
-                    lines = []
-            except Exception:
-                raise EAsciiDoc,'%s: temp file read error' % syntax
-            result = separator.join(lines)
-        finally:
-            if os.path.isfile(tmp):
-                os.remove(tmp)
+                timeout = float(timeout)
+            except ValueError:
+                message.warning('%s: illegal sys-timeout value: %s' %
+                        (syntax, timeout))
+                timeout = None
+        try:
+            output,status = shell(cmd, stderr, timeout)
+        except Exception:
+            raise EAsciiDoc,'%s: shell error: %s' % (syntax, sys.exc_info()[1])
+        if status is None:
+            message.warning('%s: timed out after %g seconds' % (syntax,timeout))
+        elif status:
+            message.warning('%s: non-zero exit status' % syntax)
+        lines = output.split('\n')
+        if lines[-1] == '':
+            del lines[-1]
+        result = separator.join([s.rstrip() for s in lines])
+        if status == 0:
+            syscache.put(name,args,separator,result)
     elif name in ('counter','counter2'):
         mo = re.match(r'^(?P<attr>[^:]*?)(:(?P<seed>.*))?$', args)
         attr = mo.group('attr')
@@ -1002,6 +1245,113 @@ def system(name, args, is_macro=False, attrs=None):
         result = '\x07' + str(len(macros.passthroughs)-1) + '\x07'
     return result
 
+class SysCache:
+    """
+    Caches system attribute results.
+    If the 'sys-cache' attribute is defined {sys:}, {sys2:} and {sys3:} system
+    attributes and system macros with identical commands are only executed
+    once. If the 'sys-cache-ttl' attribute is also set the results are saved
+    to the 'sys-cache-file' (defaults to sys-cache in the user's ~/.asciidoc
+    directory) and reused by subsequent runs for 'sys-cache-ttl' seconds.
+    {eval:} expressions are compiled once.
+    """
+    def __init__(self):
+        self.results = {}   # Key is (name,args,separator,cwd), value result.
+        self.saved = None   # Results file entries, value (time,result).
+        self.modified = False
+        self.codes = {}     # Key is eval expression, value is code object.
+        self.illegal_ttls = []
+    def compile(self,expr):
+        """Return compiled code object for eval expression 'expr'."""
+        result = self.codes.get(expr)
+        if result is None:
+            # Like eval() strip leading spaces and tabs.
+            result = compile(expr.lstrip(' \t'), '<string>', 'eval')
+            self.codes[expr] = result
+        return result
+    def enabled(self):
+        return 'sys-cache' in document.attributes and not safe()
+    def ttl(self):
+        """Return the cache file time-to-live in seconds (None if the cache
+        file is not used)."""
+        ttl = document.attributes.get('sys-cache-ttl')
+        if ttl is None or not self.fname():
+            return None
+        try:
+            return float(ttl)
+        except ValueError:
+            if ttl not in self.illegal_ttls:
+                message.warning('illegal sys-cache-ttl value: %s' % ttl)
+                self.illegal_ttls.append(ttl)
+            return None
+    def fname(self):
+        result = document.attributes.get('sys-cache-file')
+        if not result and USER_DIR:
+            result = os.path.join(USER_DIR, 'sys-cache')
+        return result
+    def load(self):
+        """Load saved results from the cache file."""
+        self.saved = {}
+        fname = self.fname()
+        if not os.path.isfile(fname):
+            return
+        try:
+            f = open(fname, 'rb')
+            try:
+                self.saved = pickle.load(f)
+            finally:
+                f.close()
+        except Exception:
+            message.warning('unable to read sys-cache-file: %s' % fname)
+            self.saved = {}
+    def save(self):
+        """Write unexpired results to the cache file."""
+        if not self.modified:
+            return
+        ttl = self.ttl()
+        if ttl is None:
+            return
+        now = time.time()
+        for k,v in self.saved.items():
+            if now - v[0] > ttl:
+                del self.saved[k]
+        fname = self.fname()
+        try:
+            f = open(fname, 'wb')
+            try:
+                pickle.dump(self.saved, f, 2)
+            finally:
+                f.close()
+        except Exception:
+            message.warning('unable to write sys-cache-file: %s' % fname)
+        self.modified = False
+    def get(self,name,args,separator):
+        """Return cached system attribute result or None if not cached."""
+        if name not in ('sys','sys2','sys3') or not self.enabled():
+            return None
+        key = (name,args,separator,os.getcwd())
+        result = self.results.get(key)
+        if result is None:
+            ttl = self.ttl()
+            if ttl is not None:
+                if self.saved is None:
+                    self.load()
+                entry = self.saved.get(key)
+                if entry is not None and time.time() - entry[0] <= ttl:
+                    result = entry[1]
+                    self.results[key] = result
+        return result
+    def put(self,name,args,separator,result):
+        if not self.enabled():
+            return
+        key = (name,args,separator,os.getcwd())
+        self.results[key] = result
+        if self.ttl() is not None:
+            if self.saved is None:
+                self.load()
+            self.saved[key] = (time.time(),result)
+            self.modified = True
+
 def subs_attrs(lines, dictionary=None):
     """Substitute 'lines' of text with attributes from the global
     document.attributes dictionary and from 'dictionary' ('dictionary'
@@ -1039,10 +1389,7 @@ def subs_attrs(lines, dictionary=None):
     else:
         # Remove numbered document attributes so they don't clash with
         # attribute list positional attributes.
-        attrs = {}
-        for k,v in document.attributes.items():
-            if not re.match(r'^\d+$', k):
-                attrs[k] = v
+        attrs = document.attributes.unnumbered()
         # Substitute attribute references inside dictionary values.
         for k,v in dictionary.items():
             if v is None:
@@ -1387,8 +1734,21 @@ class Lex:
         if not lines or not options:
             return lines
         options = Lex.canonical_subs(options)
-        # Join lines so quoting can span multiple lines.
-        para = '\n'.join(lines)
+        key = subscache.key(lines,options)
+        if key is None:
+            return Lex.subs_para('\n'.join(lines),options)
+        result = subscache.get(key)
+        if result is None:
+            result = Lex.subs_para('\n'.join(lines),options)
+            subscache.put(key,result)
+        return list(result)
+
+    @staticmethod
+    def subs_para(para,options):
+        """Perform inline processing specified by canonical 'options' on
+        paragraph string 'para' and return a list of lines."""
+        if Lex.is_verbatim(options):
+            return Lex.subs_verbatim(para,options).splitlines()
         if 'macros' in options:
             para = macros.extract_passthroughs(para)
         for o in options:
@@ -1403,6 +1763,33 @@ class Lex:
             para = macros.restore_passthroughs(para)
         return para.splitlines()
 
+    @staticmethod
+    def is_verbatim(options):
+        """Return True if 'options' only contains substitutions that can be
+        applied to a whole verbatim block in a single call."""
+        for o in options:
+            if o not in ('specialcharacters','callouts'):
+                return False
+        return True
+
+    @staticmethod
+    def subs_verbatim(s,options):
+        """Bulk version of subs_1() for verbatim 'options' (see is_verbatim()),
+        the whole block 's' is escaped with a single translation table call."""
+        plaintext = document.attributes.get('plaintext') is not None
+        for o in options:
+            if not s:
+                break
+            if plaintext:
+                o = 'specialcharacters'
+            if o == 'specialcharacters':
+                result = config.subs_specialchars(s)
+            else:
+                result = macros.subs(s,callouts=True)
+            trace(o, s, result)
+            s = result
+        return s
+
     @staticmethod
     def set_margin(lines, margin=0):
         """Utility routine that sets the left margin to 'margin' space in a
@@ -1418,6 +1805,84 @@ class Lex:
             lines[i] = ' '*margin + lines[i][width:]
         return lines
 
+class SubsCache:
+    """
+    Optional bounded LRU cache of Lex.subs() results. It is enabled by setting
+    the 'subs-cache' attribute to the maximum number of cached results (an
+    empty value uses DEFAULT_SIZE). Results are keyed by the source lines, the
+    substitutions and the document attributes subs_version, text whose
+    substitution may have side effects is never cached.
+    """
+    DEFAULT_SIZE = 1000
+    def __init__(self):
+        self.entries = {}   # Key is cache key, value is [tick,result] list.
+        self.tick = 0       # Incremented on each access (for LRU eviction).
+        self.hits = 0
+        self.misses = 0
+    def size(self):
+        """Return maximum number of cached results (0 if disabled)."""
+        size = document.attributes.get('subs-cache')
+        if size is None:
+            return 0
+        if not size:
+            return self.DEFAULT_SIZE
+        try:
+            return max(int(size),0)
+        except ValueError:
+            return self.DEFAULT_SIZE
+    def key(self,lines,options):
+        """Return cache key for substituting 'lines' with 'options' or None if
+        the cache is disabled or the result cannot be cached."""
+        if not self.size() or not self.cacheable(lines,options):
+            return None
+        return (tuple(lines), tuple(options),
+                document.attributes.subs_version)
+    @staticmethod
+    def cacheable(lines,options):
+        """Return True if substituting 'lines' with 'options' has no side
+        effects, so the result can be reused for the same input."""
+        if document.attributes.get('trace') is not None:
+            return False
+        if 'callouts' in options:
+            return False    # Callouts are numbered.
+        for line in lines:
+            # Attribute references can set attributes, increment counters and
+            # execute system commands.
+            if '{' in line or '\x07' in line:
+                return False
+            if 'macros' in options:
+                # Macro templates can have side effects (e.g. footnote
+                # counters).
+                for m in macros.macros:
+                    if m.prefix == '' and m.is_triggered(line):
+                        return False
+        return True
+    def get(self,key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.tick += 1
+        entry[0] = self.tick
+        return entry[1]
+    def put(self,key,result):
+        size = self.size()
+        if len(self.entries) >= size:
+            # Evict the least recently used quarter of the entries.
+            entries = self.entries.items()
+            entries.sort(key=lambda e: e[1][0])
+            for k,v in entries[:max(size/4,len(entries)-size+1)]:
+                del self.entries[k]
+        self.tick += 1
+        self.entries[key] = [self.tick,result]
+    def clear(self):
+        self.entries = {}
+    def report(self):
+        if self.hits or self.misses:
+            message.verbose('subs cache: %d hits, %d misses' %
+                    (self.hits, self.misses), False)
+
 #---------------------------------------------------------------------------
 # Document element classes parse AsciiDoc reader input and write DocBook writer
 # output.
@@ -1443,7 +1908,7 @@ class Document(object):
     def __init__(self):
         self.infile = None      # Source file name.
         self.outfile = None     # Output file name.
-        self.attributes = InsensitiveDict()
+        self.attributes = AttributeDict()
         self.level = 0          # 0 => front matter. 1,2,3 => sect1,2,3.
         self.has_errors = False # Set true if processing errors were flagged.
         self.has_warnings = False # Set true if warnings were flagged.
@@ -1667,7 +2132,7 @@ class Document(object):
         Section.setlevel(0) # Write remaining unwritten section close tags.
         # Substitute document parameters and write document footer.
         if config.header_footer:
-            ftr = config.subs_section('footer',{})
+            ftr = config.subs_section(chunker.footer(),{})
             writer.write(ftr,trace='footer')
     def parse_author(self,s):
         """ Return False if the author is malformed."""
@@ -1961,6 +2426,8 @@ class AttributeList:
     def consume(d={}):
         """Add attribute list to the dictionary 'd' and reset the list."""
         if AttributeList.attrs:
+            if AttributeList.attrs.get('id'):
+                idregistry.add_anchor(AttributeList.attrs['id'])
             d.update(AttributeList.attrs)
             AttributeList.attrs = {}
             # Generate option attributes.
@@ -2216,7 +2683,8 @@ class FloatingTitle(Title):
 class Section:
     """Static methods and attributes only."""
     endtags = []  # Stack of currently open section (level,endtag) tuples.
-    ids = []      # List of already used ids.
+    toc = []      # List of (level,id,sectnum,title) static TOC entries.
+    TOC_PLACEHOLDER = '<!-- toc -->' # Output line replaced by static TOC.
     def __init__(self):
         raise AssertionError,'no class instances allowed'
     @staticmethod
@@ -2251,18 +2719,7 @@ class Section:
         # defined. Prefix ensures the ID does not clash with existing IDs.
         idprefix = document.attributes.get('idprefix','_')
         base_id = idprefix + base_id
-        i = 1
-        while True:
-            if i == 1:
-                id = base_id
-            else:
-                id = '%s_%d' % (base_id, i)
-            if id not in Section.ids:
-                Section.ids.append(id)
-                return id
-            else:
-                id = base_id
-            i += 1
+        return idregistry.generate(base_id)
     @staticmethod
     def set_id():
         if not document.attributes.get('sectids') is None \
@@ -2293,19 +2750,64 @@ class Section:
                 message.warning('section title out of sequence: '
                     'expected level %d, got level %d'
                     % (document.level+1, Title.level))
-        Section.set_id()
+        toc_static = 'toc-static' in document.attributes
+        if (toc_static or chunker.level is not None) \
+                and 'id' not in AttributeList.attrs:
+            # Static TOC entries and chunk links need a link target.
+            AttributeList.attrs['id'] = Section.gen_id(Title.attributes['title'])
+        else:
+            Section.set_id()
         Section.setlevel(Title.level)
         if 'numbered' in document.attributes:
             Title.attributes['sectnum'] = Title.getnumber(document.level)
         else:
             Title.attributes['sectnum'] = ''
+        if chunker.isnext():
+            title = re.sub(r'<[^>]*>', '', Title.attributes['title'])
+            if Title.attributes['sectnum']:
+                title = '%s %s' % (Title.attributes['sectnum'], title)
+            chunker.start(title)
         AttributeList.consume(Title.attributes)
+        if toc_static:
+            Section.add_toc_entry()
         stag,etag = config.section2tags(Title.sectname,Title.attributes)
         Section.savetag(Title.level,etag)
         writer.write(stag,trace='section open: level %d: %s' %
                 (Title.level, Title.attributes['title']))
         Section.translate_body()
     @staticmethod
+    def add_toc_entry():
+        """Record the current section title if it is within toclevels."""
+        try:
+            toclevels = int(document.attributes.get('toclevels','2'))
+        except ValueError:
+            toclevels = 2
+        if Title.level <= toclevels:
+            # Links can't be nested so drop any inline markup.
+            title = re.sub(r'<[^>]*>', '', Title.attributes['title'])
+            Section.toc.append((Title.level, Title.attributes['id'],
+                    Title.attributes['sectnum'], title))
+    @staticmethod
+    def toc_lines():
+        """Return the static table of contents generated from the recorded
+        section entries using the [toc-static] and [toc-entry] templates."""
+        if not Section.toc:
+            return []
+        result = []
+        stag,etag = config.section2tags('toc-static')
+        result.extend(stag)
+        for level,id,sectnum,title in Section.toc:
+            # The title has already been substituted so, to stop braces in it
+            # being read as attribute references, a placeholder is replaced
+            # after the template attribute substitution.
+            d = {'toclevel': str(level), 'id': id, 'title': '\x07title\x07'}
+            if sectnum:
+                d['sectnum'] = sectnum
+            for line in subs_attrs(config.sections.get('toc-entry',()), d):
+                result.append(line.replace('\x07title\x07', title))
+        result.extend(etag)
+        return result
+    @staticmethod
     def translate_body(terminator=Title):
         isempty = True
         next = Lex.next()
@@ -2736,15 +3238,15 @@ class Paragraphs(AbstractBlocks):
     PREFIX = 'paradef-'
     def __init__(self):
         AbstractBlocks.__init__(self)
-        self.terminators=None    # List of compiled re's.
+        self.terminators=None    # List of combined compiled re's.
     def initialize(self):
-        self.terminators = [
-                re.compile(r'^\+$|^$'),
-                re.compile(AttributeList.pattern),
-                re.compile(blocks.delimiters),
-                re.compile(tables.delimiters),
-                re.compile(tables_OLD.delimiters),
-            ]
+        self.terminators = re_terminators([
+                r'^\+$|^$',
+                AttributeList.pattern,
+                blocks.delimiters,
+                tables.delimiters,
+                tables_OLD.delimiters,
+            ])
     def load(self,sections):
         AbstractBlocks.load(self,sections)
     def validate(self):
@@ -2799,7 +3301,8 @@ class List(AbstractBlock):
             self.text = self.mo.groupdict().get('text')
             self.index = self.mo.groupdict().get('index')
         return result
-    def translate_entry(self):
+    def open_entry(self):
+        """Write the labeled list entry and labels, return the entry tag."""
         assert self.type == 'labeled'
         entrytag = subs_tag(self.tag.entry, self.attributes)
         labeltag = subs_tag(self.tag.label, self.attributes)
@@ -2812,10 +3315,27 @@ class List(AbstractBlock):
                              self.presubs, self.attributes,trace='list term')
             if self.text: break
         writer.write(labeltag[1],trace='list label close')
-        # Write item text.
-        self.translate_item()
-        writer.write(entrytag[1],trace='list entry close')
-    def translate_item(self):
+        return entrytag
+    def open_item(self):
+        """
+        Start the next list item and write the item text. Return an
+        (entrytag,itemtag) tuple (entrytag is None unless the list is
+        labeled) or None if there are no more items.
+        """
+        # The list continues till list syntax changes or there is a new title.
+        if Lex.next() is not self or BlockTitle.title:
+            return None
+        self.ordinal += 1
+        document.attributes['listindex'] = str(self.ordinal)
+        if self.type in ('numbered','callout'):
+            self.check_index()
+        if self.type in ('bulleted','numbered','callout'):
+            reader.read()   # Discard (already parsed item first line).
+            entrytag = None
+        elif self.type == 'labeled':
+            entrytag = self.open_entry()
+        else:
+            raise AssertionError,'illegal [%s] list type' % self.defname
         if self.type == 'callout':
             self.attributes['coids'] = calloutmap.calloutids(self.ordinal)
         itemtag = subs_tag(self.tag.item, self.attributes)
@@ -2826,7 +3346,13 @@ class List(AbstractBlock):
             text = [self.text] + list(text)
         if text:
             writer.write_tag(self.tag.text, text, self.presubs, self.attributes,trace='list text')
-        # Process explicit and implicit list item continuations.
+        return (entrytag,itemtag)
+    def translate_item_elements(self):
+        """
+        Process explicit and implicit list item continuations. Return the
+        nested List if one starts the next element (it is not translated)
+        or None if the item has ended.
+        """
         while True:
             continuation = reader.read_next() == '+'
             if continuation: reader.read()  # Discard continuation line.
@@ -2835,12 +3361,12 @@ class List(AbstractBlock):
                 Lex.next().translate()
             if not continuation and BlockTitle.title:
                 # Titled elements terminate the list.
-                break
+                return None
             next = Lex.next()
             if next in lists.open:
-                break
+                return None
             elif isinstance(next,List):
-                next.translate()
+                return next
             elif isinstance(next,Paragraph) and 'listelement' in next.options:
                 next.translate()
             elif continuation:
@@ -2849,8 +3375,12 @@ class List(AbstractBlock):
                     message.error('section title not allowed in list item',halt=True)
                 next.translate()
             else:
-                break
+                return None
+    def close_item(self, tags):
+        entrytag,itemtag = tags
         writer.write(itemtag[1],trace='list item close')
+        if entrytag:
+            writer.write(entrytag[1],trace='list entry close')
 
     @staticmethod
     def calc_style(index):
@@ -2924,7 +3454,8 @@ class List(AbstractBlock):
         missing = tags.difference(self.tag.keys())
         if missing:
             self.error('missing tag(s): %s' % ','.join(missing), halt=True)
-    def translate(self):
+    def open_list(self):
+        """Start translating the list, return the list end tag."""
         AbstractBlock.translate(self)
         if self.short_name() in ('bibliography','glossary','qanda'):
             message.deprecated('old %s list syntax' % self.short_name())
@@ -2961,19 +3492,8 @@ class List(AbstractBlock):
         if stag:
             writer.write(stag,trace='list open')
         self.ordinal = 0
-        # Process list till list syntax changes or there is a new title.
-        while Lex.next() is self and not BlockTitle.title:
-            self.ordinal += 1
-            document.attributes['listindex'] = str(self.ordinal)
-            if self.type in ('numbered','callout'):
-                self.check_index()
-            if self.type in ('bulleted','numbered','callout'):
-                reader.read()   # Discard (already parsed item first line).
-                self.translate_item()
-            elif self.type == 'labeled':
-                self.translate_entry()
-            else:
-                raise AssertionError,'illegal [%s] list type' % self.defname
+        return etag
+    def close_list(self, etag):
         if etag:
             writer.write(etag,trace='list close')
         if self.type == 'callout':
@@ -2983,6 +3503,30 @@ class List(AbstractBlock):
         if len(lists.open):
             document.attributes['listindex'] = str(lists.open[-1].ordinal)
         self.pop_blockname()
+    def translate(self):
+        """
+        Translate the list along with the lists nested in its items. Nested
+        lists are processed using an explicit stack of [list, list end tag,
+        current item tags] frames instead of recursive translate() calls.
+        """
+        stack = [[self, self.open_list(), None]]
+        while stack:
+            frame = stack[-1]
+            current = frame[0]
+            if frame[2] is None:
+                frame[2] = current.open_item()
+                if frame[2] is None:
+                    # No more items.
+                    current.close_list(frame[1])
+                    stack.pop()
+                    continue
+            next = current.translate_item_elements()
+            if next is not None:
+                # Process the nested list then resume the current item.
+                stack.append([next, next.open_list(), None])
+            else:
+                current.close_item(frame[2])
+                frame[2] = None
 
 class Lists(AbstractBlocks):
     """List of List objects."""
@@ -2994,16 +3538,16 @@ class Lists(AbstractBlocks):
         AbstractBlocks.__init__(self)
         self.open = []  # A stack of the current and parent lists.
         self.tags={}    # List tags dictionary. Each entry is a tags AttrDict.
-        self.terminators=None    # List of compiled re's.
+        self.terminators=None    # List of combined compiled re's.
     def initialize(self):
-        self.terminators = [
-                re.compile(r'^\+$|^$'),
-                re.compile(AttributeList.pattern),
-                re.compile(lists.delimiters),
-                re.compile(blocks.delimiters),
-                re.compile(tables.delimiters),
-                re.compile(tables_OLD.delimiters),
-            ]
+        self.terminators = re_terminators([
+                r'^\+$|^$',
+                AttributeList.pattern,
+                lists.delimiters,
+                blocks.delimiters,
+                tables.delimiters,
+                tables_OLD.delimiters,
+            ])
     def load(self,sections):
         AbstractBlocks.load(self,sections)
         self.load_tags(sections)
@@ -3059,7 +3603,7 @@ class DelimitedBlock(AbstractBlock):
         self.push_blockname()
         options = self.parameters.options
         if 'skip' in options:
-            reader.read_until(self.delimiter,same_file=True)
+            reader.read_verbatim(self.delimiter)
         elif safe() and self.defname == 'blockdef-backend':
             message.unsafe('Backend Block')
             reader.read_until(self.delimiter,same_file=True)
@@ -3075,9 +3619,13 @@ class DelimitedBlock(AbstractBlock):
                 writer.write(etag,trace=name+' close')
             else:
                 stag = config.section2tags(template,self.attributes,skipend=True)[0]
-                body = reader.read_until(self.delimiter,same_file=True)
                 presubs = self.parameters.presubs
                 postsubs = self.parameters.postsubs
+                subs = list(presubs or []) + list(postsubs or [])
+                if 'attributes' in subs or 'macros' in subs:
+                    body = reader.read_until(self.delimiter,same_file=True)
+                else:
+                    body = reader.read_verbatim(self.delimiter)
                 body = Lex.subs(body,presubs)
                 if self.parameters.filter:
                     body = filter_lines(self.parameters.filter,body,self.attributes)
@@ -3105,8 +3653,9 @@ class DelimitedBlocks(AbstractBlocks):
     def validate(self):
         AbstractBlocks.validate(self)
 
-class Column:
+class Column(object):
     """Table column."""
+    __slots__ = ('width','halign','valign','style','abswidth','pcwidth')
     def __init__(self, width=None, align_spec=None, style=None):
         self.width = width or '1'
         self.halign, self.valign = Table.parse_align_spec(align_spec)
@@ -3115,7 +3664,9 @@ class Column:
         self.abswidth = None    # 1..   (page units).
         self.pcwidth = None     # 1..99 (percentage).
 
-class Cell:
+class Cell(object):
+    __slots__ = ('data','span','vspan','halign','valign','style','reserved')
+    reserved_cells = {} # Shared row span placeholders keyed by column span.
     def __init__(self, data, span_spec=None, align_spec=None, style=None):
         self.data = data
         self.span, self.vspan = Table.parse_span_spec(span_spec)
@@ -3128,17 +3679,29 @@ class Cell:
                 self.halign, self.valign,
                 self.style or '',
                 self.data)
-    def clone_reserve(self):
-        """Return a clone of self to reserve vertically spanned cell."""
-        result = copy.copy(self)
-        result.vspan = 1
-        result.reserved = True
+    @staticmethod
+    def reserve(span):
+        """
+        Return the shared placeholder that reserves a vertically spanned
+        cell 'span' columns wide. Placeholders are never rendered so a
+        single instance per span width serves every table.
+        """
+        result = Cell.reserved_cells.get(span)
+        if result is None:
+            result = Cell(None, str(span))
+            result.reserved = True
+            Cell.reserved_cells[span] = result
         return result
 
 class Table(AbstractBlock):
     ALIGN = {'<':'left', '>':'right', '^':'center'}
     VALIGN = {'<':'top', '>':'bottom', '^':'middle'}
     FORMATS = ('psv','csv','dsv')
+    CACHE_SIZE = 1000   # Maximum entries in cell tag and data caches.
+    WORKERS_MIN_ROWS = 1000 # Smallest body rendered by 'table-workers'.
+    # Attributes that are set for each table cell.
+    CELL_ATTRIBUTES = ('halign','valign','colabswidth','colpcwidth',
+            'colnumber','colspan','colstart','colend','rowspan','morerows')
     SEPARATORS = dict(
         csv=',',
         dsv=r':|\n',
@@ -3353,16 +3916,22 @@ class Table(AbstractBlock):
         Generate column related substitution attributes.
         """
         cols = []
+        templates = {}  # Compiled colspec tags.
         i = 1
         for col in self.columns:
             colspec = self.get_tags(col.style).colspec
             if colspec:
-                self.attributes['halign'] = col.halign
-                self.attributes['valign'] = col.valign
-                self.attributes['colabswidth'] = col.abswidth
-                self.attributes['colpcwidth'] = col.pcwidth
-                self.attributes['colnumber'] = str(i)
-                s = subs_attrs(colspec, self.attributes)
+                attrs = templates.get(colspec)
+                if attrs is None:
+                    attrs = self.compile_tag(colspec)
+                    templates[colspec] = attrs
+                attrs = attrs.copy()
+                attrs['halign'] = col.halign
+                attrs['valign'] = col.valign
+                attrs['colabswidth'] = col.abswidth
+                attrs['colpcwidth'] = col.pcwidth
+                attrs['colnumber'] = str(i)
+                s = subs_attrs(colspec, attrs)
                 if not s:
                     message.warning('colspec dropped: contains undefined attribute')
                 else:
@@ -3370,69 +3939,77 @@ class Table(AbstractBlock):
             i += 1
         if cols:
             self.attributes['colspecs'] = writer.newline.join(cols)
-    def parse_rows(self, text):
+    def parse_rows(self, text, cells=None):
         """
         Parse the table source text into self.rows (a list of rows, each row
-        is a list of Cells.
+        is a list of Cells. 'cells' are the PSV or DSV text already parsed by
+        parse_psv_dsv(). Row span warnings are collected while the rows are
+        built.
         """
-        reserved = {}  # Reserved cells generated by rowspans.
+        empty_rows = []     # Indexes of rows containing only spanned cells.
+        row_spans = []      # Sum of cell spans for each row.
         if self.parameters.format in ('psv','dsv'):
             colcount = len(self.columns)
-            parsed_cells = self.parse_psv_dsv(text)
+            if cells is None:
+                cells = self.parse_psv_dsv(text)[0]
+            # Column occupancy array, each item is None or a (lastrow,cell)
+            # tuple where cell is the placeholder reserved by a row span up to
+            # and including row index lastrow.
+            occupied = [None] * colcount
             ri = 0  # Current row index 0..
             ci = 0  # Column counter 0..colcount
             row = []
+            row_span = 0
+            empty = True
             i = 0
+            n = len(cells)
             while True:
-                resv = reserved.get(ri) and reserved[ri].get(ci)
-                if resv:
+                resv = occupied[ci]
+                if resv and resv[0] >= ri:
                     # We have a cell generated by a previous row span so
                     # process it before continuing with the current parsed
                     # cell.
-                    cell = resv
+                    cell = resv[1]
                 else:
-                    if i >= len(parsed_cells):
+                    if i >= n:
                         break   # No more parsed or reserved cells.
-                    cell = parsed_cells[i]
+                    cell = cells[i]
                     i += 1
                     if cell.vspan > 1:
-                        # Generate ensuing reserved cells spanned vertically by
-                        # the current cell.
-                        for j in range(1, cell.vspan):
-                            if not ri+j in reserved:
-                                reserved[ri+j] = {}
-                            reserved[ri+j][ci] = cell.clone_reserve()
+                        # Reserve the ensuing cells spanned vertically by the
+                        # current cell.
+                        occupied[ci] = (ri + cell.vspan - 1, Cell.reserve(cell.span))
                 ci += cell.span
                 if ci <= colcount:
                     row.append(cell)
+                    row_span += cell.span
+                    if not cell.reserved:
+                        empty = False
                 if ci >= colcount:
                     self.rows.append(row)
+                    row_spans.append(row_span)
+                    if empty:
+                        empty_rows.append(ri)
                     ri += 1
                     row = []
+                    row_span = 0
+                    empty = True
                     ci = 0
         elif self.parameters.format == 'csv':
             self.rows = self.parse_csv(text)
+            for ri,row in enumerate(self.rows):
+                row_spans.append(len(row))
+                if not row:
+                    empty_rows.append(ri)
         else:
             assert True,'illegal table format'
-        # Check for empty rows containing only reserved (spanned) cells.
-        for ri,row in enumerate(self.rows):
-            empty = True
-            for cell in row:
-                if not cell.reserved:
-                    empty = False
-                    break
-            if empty:
-                message.warning('table row %d: empty spanned row' % (ri+1))
-        # Check that all row spans match.
-        for ri,row in enumerate(self.rows):
-            row_span = 0
-            for cell in row:
-                row_span += cell.span
-            if ri == 0:
-                header_span = row_span
-            if row_span < header_span:
+        for ri in empty_rows:
+            message.warning('table row %d: empty spanned row' % (ri+1))
+        # Check that all row spans match the first row.
+        for ri,row_span in enumerate(row_spans):
+            if row_span < row_spans[0]:
                 message.warning('table row %d: does not span all columns' % (ri+1))
-            if row_span > header_span:
+            if row_span > row_spans[0]:
                 message.warning('table row %d: exceeds columns span' % (ri+1))
     def subs_rows(self, rows, rowtype='body'):
         """
@@ -3447,12 +4024,217 @@ class Table(AbstractBlock):
         else:
             rtag = tags.bodyrow
         result = []
-        stag,etag = subs_tag(rtag,self.attributes)
+        stag,etag = self.subs_cell_tag(rtag)
         for row in rows:
             result.append(stag)
-            result += self.subs_row(row,rowtype)
+            result.extend(self.subs_row(row,rowtype))
             result.append(etag)
         return writer.newline.join(result)
+    def workers(self):
+        """
+        Return the number of processes that should render the body rows (0
+        if they are rendered serially). Parallel rendering is enabled by the
+        'table-workers' attribute and only applies to large tables whose
+        cells and tags cannot change global state (attributes, counters,
+        anchors, callouts).
+        """
+        workers = document.attributes.get('table-workers')
+        if workers is None or len(self.rows) < Table.WORKERS_MIN_ROWS:
+            return 0
+        if not hasattr(os,'fork'):
+            return 0    # Workers must inherit the parsed table.
+        try:
+            import multiprocessing
+        except ImportError:
+            return 0    # Python < 2.6.
+        try:
+            workers = int(workers)
+        except ValueError:
+            workers = multiprocessing.cpu_count()
+        if workers < 2:
+            return 0
+        for tags in tables.tags.values():
+            for k in ('bodyrow','bodydata','paragraph'):
+                if re.search(r'{[\w-]+:',tags.get(k) or ''):
+                    return 0
+        # Styles are dictionaries so they are keyed by id (like
+        # style_params()).
+        styles = {}
+        for col in self.columns:
+            styles[id(col.style)] = col.style
+        for row in self.rows:
+            for cell in row:
+                if not cell.reserved:
+                    styles[id(cell.style)] = cell.style
+        options = []
+        for style in styles.values():
+            tags,presubs,postsubs,filter = self.style_params(style)
+            for o in presubs+postsubs:
+                if o not in options:
+                    options.append(o)
+        for row in self.rows:
+            for cell in row:
+                if not cell.reserved and \
+                        not SubsCache.cacheable([cell.data],options):
+                    return 0
+        return workers
+    def subs_body_rows(self):
+        """
+        Return the output markup for the body rows. If workers() allows
+        chunks of rows are rendered by a process pool and joined back in
+        order; the last chunk is rendered here so the cell attributes are
+        left set just as they are by serial rendering.
+        """
+        workers = self.workers()
+        if not workers:
+            return self.subs_rows(self.rows)
+        import multiprocessing
+        size = (len(self.rows) + workers*4 - 1) / (workers*4)
+        spans = [(i, i+size) for i in range(0, len(self.rows), size)]
+        # Forked processes inherit unwritten output buffers.
+        writer.f.flush()
+        sys.stdout.flush()
+        pool = multiprocessing.Pool(workers)
+        try:
+            pending = pool.map_async(subs_table_rows, spans[:-1])
+            last = self.subs_rows(self.rows[spans[-1][0]:])
+            result = []
+            for rows,messages,has_warnings,has_errors in pending.get():
+                result.append(rows)
+                message.messages.extend(messages)
+                document.has_warnings = document.has_warnings or has_warnings
+                document.has_errors = document.has_errors or has_errors
+            result.append(last)
+        finally:
+            pool.close()
+            pool.join()
+        return writer.newline.join(result)
+    def set_cell_attributes(self, values):
+        """Set the per cell substitution attributes from the tuple of
+        Table.CELL_ATTRIBUTES values."""
+        for k,v in zip(Table.CELL_ATTRIBUTES,values):
+            self.attributes[k] = v
+    def style_params(self, colstyle):
+        """Return (tags,presubs,postsubs,filter) tuple for column style."""
+        key = id(colstyle)
+        result = self.style_cache.get(key)
+        if result is None:
+            presubs,postsubs = self.get_subs(colstyle)
+            result = (self.get_tags(colstyle),
+                      tuple(Lex.canonical_subs(presubs or ())),
+                      tuple(Lex.canonical_subs(postsubs or ())),
+                      self.get_param('filter',colstyle))
+            self.style_cache[key] = result
+        return result
+    def cell_values(self, i, cell):
+        """Return the tuple of Table.CELL_ATTRIBUTES values for 'cell' in
+        column index 'i'."""
+        col = self.columns[i]
+        colnumber = str(i+1)
+        return (cell.halign or col.halign, cell.valign or col.valign,
+                col.abswidth, col.pcwidth, colnumber, str(cell.span),
+                colnumber, str(i+cell.span), str(cell.vspan),
+                str(cell.vspan-1))
+    def compile_tag(self, tag):
+        """Return a dictionary of the table level attributes that could be
+        referenced by 'tag', resolved once so that per cell substitutions
+        only need to fill in the Table.CELL_ATTRIBUTES."""
+        names = set(re.findall(r'[-\w]+', tag))
+        result = {}
+        for k,v in self.attributes.items():
+            if k in names and k not in Table.CELL_ATTRIBUTES:
+                result[k] = v
+        return result
+    def subs_cell_tag(self, tag, i=None, cell=None):
+        """Return the substituted (stag,etag) for 'cell' in column index 'i'
+        (or the row tag if 'cell' is None). Tags are compiled once per table
+        and the result for each column and distinct combination of cell
+        alignment and spans is remembered."""
+        if not tag:
+            return [None,None]
+        if self.tag_version != document.attributes.version:
+            # Document attributes have changed so recompile.
+            self.tag_templates = {}
+            self.tag_cache = {}
+            self.tag_version = document.attributes.version
+        if cell is None:
+            key = (tag,)
+        else:
+            key = (tag, i, cell.halign, cell.valign, cell.span, cell.vspan)
+        result = self.tag_cache.get(key)
+        if result is None:
+            attrs = self.tag_templates.get(tag)
+            if attrs is None:
+                attrs = self.compile_tag(tag)
+                self.tag_templates[tag] = attrs
+            attrs = attrs.copy()
+            if cell is not None:
+                attrs.update(zip(Table.CELL_ATTRIBUTES,
+                                 self.cell_values(i,cell)))
+            result = subs_tag(tag,attrs)
+            if result[0] is not None and not re.search(r'{[\w-]+:',tag):
+                # Cache unless dropped (so it is reported again) or the tag
+                # contains system attributes (e.g. counters).
+                if len(self.tag_cache) >= Table.CACHE_SIZE:
+                    self.tag_cache = {}
+                self.tag_cache[key] = result
+        return result
+    def subs_cell_data(self, data, presubs, postsubs, filter, values):
+        """Return the substituted list of cell 'data' lines."""
+        key = None
+        if not filter:
+            # Only side effect free results are cached.
+            key = (data, presubs, postsubs,
+                    document.attributes.subs_version)
+            result = self.data_cache.get(key)
+            if result is not None:
+                return result
+            if not SubsCache.cacheable([data],presubs+postsubs):
+                key = None
+        data = Lex.subs([data], presubs)
+        if filter:
+            self.set_cell_attributes(values)
+            data = filter_lines(filter, data, self.attributes)
+        data = Lex.subs(data, postsubs)
+        if key is not None:
+            if len(self.data_cache) >= Table.CACHE_SIZE:
+                self.data_cache = {}
+            self.data_cache[key] = data
+        return data
+    @staticmethod
+    def tag_paragraphs(data, stag, etag):
+        """
+        Return the substituted cell 'data' lines with each paragraph
+        (paragraphs are separated by blank lines) enclosed by the paragraph
+        start and end tags.
+        """
+        if len(data) == 1 and '\n' not in data[0]:
+            lines = [data[0].strip()]   # Single line cell.
+        else:
+            lines = '\n'.join(data).strip().split('\n')
+        if not lines[0]:
+            return dovetail_tags([stag],[''],[etag])    # Empty cell.
+        stag = stag or ''
+        etag = etag or ''
+        result = []
+        n = len(lines)
+        start = 0
+        while start < n:
+            # Find the line range of the paragraph starting at start.
+            end = start + 1
+            while end < n and lines[end]:
+                end += 1
+            if end - start == 1:
+                result.append(stag + lines[start] + etag)
+            else:
+                result.append(stag + lines[start])
+                result.extend(lines[start+1:end-1])
+                result.append(lines[end-1] + etag)
+            # Skip the blank lines separating paragraphs.
+            start = end + 1
+            while start < n and not lines[start]:
+                start += 1
+        return result
     def subs_row(self, row, rowtype):
         """
         Substitute the list of Cells using the data tag.
@@ -3460,6 +4242,7 @@ class Table(AbstractBlock):
         """
         result = []
         i = 0
+        last = None
         for cell in row:
             if cell.reserved:
                 # Skip vertically spanned placeholders.
@@ -3468,51 +4251,36 @@ class Table(AbstractBlock):
             if i >= len(self.columns):
                 break   # Skip cells outside the header width.
             col = self.columns[i]
-            self.attributes['halign'] = cell.halign or col.halign
-            self.attributes['valign'] = cell.valign or  col.valign
-            self.attributes['colabswidth'] = col.abswidth
-            self.attributes['colpcwidth'] = col.pcwidth
-            self.attributes['colnumber'] = str(i+1)
-            self.attributes['colspan'] = str(cell.span)
-            self.attributes['colstart'] = self.attributes['colnumber']
-            self.attributes['colend'] = str(i+cell.span)
-            self.attributes['rowspan'] = str(cell.vspan)
-            self.attributes['morerows'] = str(cell.vspan-1)
-            # Fill missing column data with blanks.
-            if i > len(self.columns) - 1:
-                data = ''
-            else:
-                data = cell.data
             if rowtype == 'header':
                 # Use table style unless overriden by cell style.
                 colstyle = cell.style
             else:
                 # If the cell style is not defined use the column style.
                 colstyle = cell.style or col.style
-            tags = self.get_tags(colstyle)
-            presubs,postsubs = self.get_subs(colstyle)
-            data = [data]
-            data = Lex.subs(data, presubs)
-            data = filter_lines(self.get_param('filter',colstyle),
-                                data, self.attributes)
-            data = Lex.subs(data, postsubs)
+            tags,presubs,postsubs,filter = self.style_params(colstyle)
+            values = None
+            if filter:
+                values = self.cell_values(i,cell)
+            data = self.subs_cell_data(cell.data, presubs, postsubs, filter,
+                    values)
             if rowtype != 'header':
                 ptag = tags.paragraph
                 if ptag:
-                    stag,etag = subs_tag(ptag,self.attributes)
-                    text = '\n'.join(data).strip()
-                    data = []
-                    for para in re.split(r'\n{2,}',text):
-                        data += dovetail_tags([stag],para.split('\n'),[etag])
+                    stag,etag = self.subs_cell_tag(ptag,i,cell)
+                    data = Table.tag_paragraphs(data, stag, etag)
             if rowtype == 'header':
                 dtag = tags.headdata
             elif rowtype == 'footer':
                 dtag = tags.footdata
             else:
                 dtag = tags.bodydata
-            stag,etag = subs_tag(dtag,self.attributes)
-            result = result + dovetail_tags([stag],data,[etag])
+            stag,etag = self.subs_cell_tag(dtag,i,cell)
+            result.extend(dovetail_tags([stag],data,[etag]))
+            last = (i,cell)
             i += cell.span
+        if last is not None:
+            # Leave the last cell's attributes set.
+            self.set_cell_attributes(self.cell_values(*last))
         return result
     def parse_csv(self,text):
         """
@@ -3532,46 +4300,54 @@ class Table(AbstractBlock):
         return rows
     def parse_psv_dsv(self,text):
         """
-        Parse list of PSV or DSV table source text lines and return a list of
-        Cells.
+        Parse list of PSV or DSV table source text lines and return a tuple
+        containing the list of Cells and the sum of the spans of the cells in
+        the first line (the implied column count).
         """
-        def append_cell(data, span_spec, op, align_spec, style):
-            op = op or '+'
-            if op == '*':   # Cell multiplier.
-                span = Table.parse_span_spec(span_spec)[0]
-                for i in range(span):
-                    cells.append(Cell(data, '1', align_spec, style))
-            elif op == '+': # Column spanner.
-                cells.append(Cell(data, span_spec, align_spec, style))
-            else:
-                self.error('illegal table cell operator')
+        eol = len(text[0])  # End of first line.
         text = '\n'.join(text)
         separator = '(?msu)'+self.parameters.separator
         format = self.parameters.format
-        start = 0
-        span = None
-        op = None
-        align = None
-        style = None
         cells = []
-        data = ''
+        firstline = None    # Number of cells starting in the first line.
+        styles = {}     # Cache of style names and style dictionaries.
+        span = op = align = style = None    # Current cell specifiers.
+        pieces = []     # Non-empty slices of the current cell data.
+        start = 0
         for mo in re.finditer(separator,text):
-            data += text[start:mo.start()]
-            if data.endswith('\\'):
-                data = data[:-1]+mo.group() # Reinstate escaped separators.
+            if mo.start() > start:
+                pieces.append(text[start:mo.start()])
+            if pieces and pieces[-1][-1] == '\\':
+                # Reinstate escaped separator.
+                pieces[-1] = pieces[-1][:-1]
+                if not pieces[-1]:
+                    pieces.pop()
+                if mo.group():
+                    pieces.append(mo.group())
             else:
-                append_cell(data, span, op, align, style)
-                span = mo.groupdict().get('span')
-                op = mo.groupdict().get('op')
-                align = mo.groupdict().get('align')
-                style = mo.groupdict().get('style')
+                self.append_cell(cells, ''.join(pieces), span, op, align, style)
+                if firstline is None and mo.start() >= eol:
+                    firstline = len(cells)
+                pieces = []
+                d = mo.groupdict()
+                span = d.get('span')
+                op = d.get('op')
+                align = d.get('align')
+                style = d.get('style')
                 if style:
-                    style = self.get_style(style)
-                data = ''
+                    if style in styles:
+                        style = styles[style]
+                    else:
+                        name = style
+                        style = self.get_style(name)
+                        if style is not None:
+                            styles[name] = style
             start = mo.end()
         # Last cell follows final separator.
-        data += text[start:]
-        append_cell(data, span, op, align, style)
+        pieces.append(text[start:])
+        self.append_cell(cells, ''.join(pieces), span, op, align, style)
+        if firstline is None:
+            firstline = len(cells)
         # We expect a dummy blank item preceeding first PSV cell.
         if format == 'psv':
             if cells[0].data.strip() != '':
@@ -3579,13 +4355,34 @@ class Table(AbstractBlock):
                         self.start)
             else:
                 cells.pop(0)
-        return cells
+                firstline -= 1
+        cols = 0
+        for cell in cells[:firstline]:
+            cols += cell.span
+        return cells, cols
+    def append_cell(self, cells, data, span_spec, op, align_spec, style):
+        """Append Cell (or multiplied Cells) to the 'cells' list."""
+        if not op or op == '+': # Column spanner.
+            cells.append(Cell(data, span_spec, align_spec, style))
+        elif op == '*':   # Cell multiplier.
+            span = Table.parse_span_spec(span_spec)[0]
+            for i in range(span):
+                cells.append(Cell(data, '1', align_spec, style))
+        else:
+            self.error('illegal table cell operator')
     def translate(self):
         AbstractBlock.translate(self)
         reader.read()   # Discard delimiter.
         # Reset instance specific properties.
         self.columns = []
         self.rows = []
+        # Caches: column style parameters, compiled and substituted tags and
+        # side effect free cell data substitutions.
+        self.style_cache = {}
+        self.tag_templates = {}
+        self.tag_cache = {}
+        self.tag_version = None
+        self.data_cache = {}
         attrs = {}
         BlockTitle.consume(attrs)
         # Mix in document attribute list.
@@ -3604,24 +4401,32 @@ class Table(AbstractBlock):
         else:
             delimiter = reader.read()   # Discard closing delimiter.
             assert re.match(self.delimiter,delimiter)
+        if 'file' in self.attributes:
+            self.push_blockname('table')
+            self.translate_file(self.attributes['file'], text, attrs)
+            self.pop_blockname()
+            return
         if len(text) == 0:
             message.warning('[%s] table is empty' % self.defname)
             return
         self.push_blockname('table')
         cols = attrs.get('cols')
-        if not cols:
-            # Calculate column count from number of items in first line.
-            if self.parameters.format == 'csv':
+        cells = None
+        if self.parameters.format == 'csv':
+            if not cols:
+                # Calculate column count from number of items in first line.
                 cols = text[0].count(self.parameters.separator) + 1
-            else:
-                cols = 0
-                for cell in self.parse_psv_dsv(text[:1]):
-                    cols += cell.span
+        else:
+            # The column count implied by the first line comes from the same
+            # parse as the cells.
+            cells,firstcols = self.parse_psv_dsv(text)
+            if not cols:
+                cols = firstcols
         self.parse_cols(cols, attrs.get('halign'), attrs.get('valign'))
         # Set calculated attributes.
         self.attributes['colcount'] = len(self.columns)
         self.build_colspecs()
-        self.parse_rows(text)
+        self.parse_rows(text, cells)
         # The 'rowcount' attribute is used by the experimental LaTeX backend.
         self.attributes['rowcount'] = str(len(self.rows))
         # Generate headrows, footrows, bodyrows.
@@ -3643,7 +4448,7 @@ class Table(AbstractBlock):
             self.attributes['footrows'] = '\x07footrows\x07'
             self.rows = self.rows[:-1]
         if self.rows:
-            bodyrows = self.subs_rows(self.rows)
+            bodyrows = self.subs_body_rows()
             self.attributes['bodyrows'] = '\x07bodyrows\x07'
         table = subs_attrs(config.sections[self.parameters.template],
                            self.attributes)
@@ -3659,6 +4464,156 @@ class Table(AbstractBlock):
         writer.write(table,trace='table')
         self.pop_blockname()
 
+    def read_file_rows(self, f, colcount=None):
+        """
+        Generate rows of Cells from CSV or DSV table data file object 'f'.
+        DSV lines are split into cells which are assembled into rows of
+        'colcount' cells (if 'colcount' is None each line is a row), like
+        inline DSV data an incomplete last row is dropped.
+        """
+        import csv
+        if self.parameters.format == 'csv':
+            rdr = csv.reader(f, delimiter=self.parameters.separator,
+                             skipinitialspace=True)
+            try:
+                for row in rdr:
+                    yield [Cell(data) for data in row]
+            except csv.Error:
+                self.error('csv parse error: %s: line %d'
+                        % (f.name, rdr.line_num))
+        else:
+            row = []
+            for line in f:
+                line = line.expandtabs(config.tabsize).rstrip()
+                cells = self.parse_psv_dsv([line])[0]
+                if colcount is None:
+                    yield cells
+                    continue
+                for cell in cells:
+                    row.append(cell)
+                    if len(row) == colcount:
+                        yield row
+                        row = []
+    def translate_file(self, fname, text, attrs):
+        """
+        Translate CSV or DSV table whose data is read from the external file
+        'fname'. Rows are streamed from the file through cell rendering to
+        the writer so only one row is held in memory at a time.
+        """
+        if text:
+            message.warning('[%s] table data ignored: file attribute is set'
+                    % self.defname)
+        if self.parameters.format not in ('csv','dsv'):
+            self.error('file attribute requires csv or dsv format')
+            return
+        if reader.fname == '<stdin>':
+            parentdir = os.getcwd()
+        else:
+            parentdir = os.path.dirname(reader.fname)
+        fname = safe_filename(subs_attrs(fname), parentdir)
+        if not fname:
+            return
+        if not os.path.isfile(fname):
+            self.error('missing table file: %s' % fname)
+            return
+        message.verbose('table file: %s' % fname)
+        cols = attrs.get('cols')
+        # First pass: count the rows and save the first and last rows.
+        f = open(fname,'rb')
+        try:
+            if not cols:
+                rows = self.read_file_rows(f, None)
+                for row in rows:
+                    cols = len(row)
+                    break
+                f.seek(0)
+            if not cols:
+                message.warning('[%s] table is empty' % self.defname)
+                return
+            self.parse_cols(cols, attrs.get('halign'), attrs.get('valign'))
+            colcount = len(self.columns)
+            rowcount = 0
+            first = last = None
+            for row in self.read_file_rows(f, colcount):
+                if first is None:
+                    first = row
+                last = row
+                rowcount += 1
+                if len(row) < colcount:
+                    message.warning('table row %d: does not span all columns'
+                            % rowcount)
+                elif len(row) > colcount:
+                    message.warning('table row %d: exceeds columns span'
+                            % rowcount)
+        finally:
+            f.close()
+        if not rowcount:
+            message.warning('[%s] table is empty' % self.defname)
+            return
+        self.attributes['colcount'] = colcount
+        self.build_colspecs()
+        self.attributes['rowcount'] = str(rowcount)
+        for option in self.parameters.options:
+            self.attributes[option+'-option'] = ''
+        headrows = footrows = None
+        skip_first = skip_last = False
+        if 'header' in self.parameters.options:
+            headrows = self.subs_rows([first],'header')
+            self.attributes['headrows'] = '\x07headrows\x07'
+            skip_first = True
+            rowcount -= 1
+        if rowcount and 'footer' in self.parameters.options:
+            footrows = self.subs_rows([last],'footer')
+            self.attributes['footrows'] = '\x07footrows\x07'
+            skip_last = True
+            rowcount -= 1
+        if rowcount:
+            self.attributes['bodyrows'] = '\x07bodyrows\x07'
+        table = subs_attrs(config.sections[self.parameters.template],
+                           self.attributes)
+        table = writer.newline.join(table)
+        if headrows:
+            table = table.replace('\x07headrows\x07', headrows, 1)
+        if footrows:
+            table = table.replace('\x07footrows\x07', footrows, 1)
+        if not rowcount:
+            writer.write(table,trace='table')
+            return
+        # Second pass: write the body rows as they are read.
+        head,tail = table.split('\x07bodyrows\x07', 1)
+        trace('table', head)
+        newline = writer.newline
+        line = head
+        f = open(fname,'rb')
+        try:
+            rows = self.read_file_rows(f, colcount)
+            if skip_first:
+                rows.next()
+            for i in xrange(rowcount):
+                row = rows.next()
+                if i > 0:
+                    line += newline
+                line += self.subs_rows([row])
+                lines = line.split(newline)
+                writer.write(lines[:-1])
+                line = lines[-1]
+        finally:
+            f.close()
+        writer.write((line + tail).split(newline))
+
+def subs_table_rows(span):
+    """
+    Process pool worker: return (output, messages, has_warnings, has_errors)
+    for the (start,end) slice of the body rows of the table being
+    translated, the table is inherited from the forked parent process.
+    """
+    count = len(message.messages)
+    document.has_warnings = document.has_errors = False
+    table = tables.current
+    rows = table.subs_rows(table.rows[span[0]:span[1]])
+    return (rows, message.messages[count:], document.has_warnings,
+            document.has_errors)
+
 class Tables(AbstractBlocks):
     """List of tables."""
     BLOCK_TYPE = Table
@@ -3739,17 +4694,24 @@ class Macros:
     # Default system macro syntax.
     SYS_RE = r'(?u)^(?P<name>[\\]?\w(\w|-)*?)::(?P<target>\S*?)' + \
              r'(\[(?P<attrlist>.*?)\])$'
+    # Passthrough placeholder syntax.
+    PLACEHOLDER_RE = '\x07(?P<index>\\d+)\x07'
     def __init__(self):
         self.macros = []        # List of Macros.
+        self.placeholder_reo = re.compile(self.PLACEHOLDER_RE)
         self.current = None     # The last matched block macro.
         self.passthroughs = []
+        self.system_text = None # The last text matched against system macros.
+        self.system_matches = []    # The (macro,match object) tuples for it.
         # Initialize default system macro.
         m = Macro()
         m.pattern = self.SYS_RE
         m.prefix = '+'
         m.reo = re.compile(m.pattern)
+        m.literals = re_literals(m.pattern)
         self.macros.append(m)
     def load(self,entries):
+        self.system_text = None
         for entry in entries:
             m = Macro()
             m.load(entry)
@@ -3793,7 +4755,8 @@ class Macros:
         for m in self.macros:
             if m.prefix == prefix:
                 if callouts ^ (m.name != 'callout'):
-                    result = m.subs(result)
+                    if m.is_triggered(result):
+                        result = m.subs(result)
         return result
     def isnext(self):
         """Return matching macro if block macro is next on reader."""
@@ -3802,36 +4765,58 @@ class Macros:
         if line:
             for m in self.macros:
                 if m.prefix == '#':
-                    if m.reo.match(line):
+                    if m.is_triggered(line) and m.reo.match(line):
                         self.current = m
                         return m
         return False
     def match(self,prefix,name,text):
         """Return re match object matching 'text' with macro type 'prefix',
         macro name 'name'."""
-        for m in self.macros:
-            if m.prefix == prefix:
-                mo = m.reo.match(text)
-                if mo:
-                    if m.name == name:
-                        return mo
-                    if re.match(name, mo.group('name')):
-                        return mo
+        if prefix == '+':
+            matches = self.match_system(text)
+        else:
+            matches = ((m,m.reo.match(text)) for m in self.macros
+                        if m.prefix == prefix)
+        for m,mo in matches:
+            if mo:
+                if m.name == name:
+                    return mo
+                if re.match(name, mo.group('name')):
+                    return mo
         return None
+    def match_system(self,text):
+        """Return list of (macro,match object) tuples for the system macros
+        matching 'text'. The reader checks each line for several system
+        macros so the result for the last line is cached."""
+        if text != self.system_text:
+            self.system_matches = []
+            for m in self.macros:
+                if m.prefix == '+' and m.is_triggered(text):
+                    mo = m.reo.match(text)
+                    if mo:
+                        self.system_matches.append((m,mo))
+            self.system_text = text
+        return self.system_matches
     def extract_passthroughs(self,text,prefix=''):
         """ Extract the passthrough text and replace with temporary
         placeholders."""
         self.passthroughs = []
         for m in self.macros:
             if m.has_passthrough() and m.prefix == prefix:
-                text = m.subs_passthroughs(text, self.passthroughs)
+                if m.is_triggered(text):
+                    text = m.subs_passthroughs(text, self.passthroughs)
         return text
     def restore_passthroughs(self,text):
         """ Replace passthough placeholders with the original passthrough
         text."""
-        for i,v in enumerate(self.passthroughs):
-            text = text.replace('\x07'+str(i)+'\x07', self.passthroughs[i])
-        return text
+        if not self.passthroughs:
+            return text
+        def subs_func(mo):
+            i = int(mo.group('index'))
+            if i < len(self.passthroughs):
+                return self.passthroughs[i]
+            return mo.group()
+        return self.placeholder_reo.sub(subs_func, text)
 
 class Macro:
     def __init__(self):
@@ -3840,8 +4825,18 @@ class Macro:
         self.prefix = ''        # '' if inline, '+' if system, '#' if block.
         self.reo = None         # Compiled pattern re object.
         self.subslist = []      # Default subs for macros passtext group.
+        self.literals = None    # Strings one of which must occur in a match.
     def has_passthrough(self):
         return self.pattern.find(r'(?P<passtext>') >= 0
+    def is_triggered(self,text):
+        """Return False if text contains none of the literal strings required
+        by the macro pattern (so the pattern cannot match)."""
+        if self.literals:
+            for literal in self.literals:
+                if literal in text:
+                    return True
+            return False
+        return True
     def section_name(self,name=None):
         """Return macro markup template section name based on macro name and
         prefix.  Return None section not found."""
@@ -3884,6 +4879,7 @@ class Macro:
                                  'illegal subs in macro entry: %s' % entry)
         self.pattern = pattern
         self.reo = re.compile(pattern)
+        self.literals = re_literals(pattern)
         self.prefix = prefix
         self.name = name
         self.subslist = subslist or []
@@ -3936,6 +4932,19 @@ class Macro:
             if name == 'callout':
                 listindex =int(d['index'])
                 d['coid'] = calloutmap.add(listindex)
+            # Register cross reference targets and anchors.
+            if name in ('anchor','xref'):
+                id = d.get('target')
+            elif name in ('anchor2','anchor3','xref2'):
+                id = d.get('1')
+            else:
+                id = None
+            if id:
+                if name.startswith('xref'):
+                    # Locate the line containing the reference.
+                    idregistry.add_xref(id, -mo.string.count('\n',mo.end()))
+                else:
+                    idregistry.add_anchor(id)
             # The alt attribute is the first image macro positional attribute.
             if name == 'image' and '1' in d:
                 d['alt'] = d['1']
@@ -4004,7 +5013,7 @@ class Macro:
                         d.get('name',''))
                 return mo.group()
             passtext = d['passtext']
-            if re.search('\x07\\d+\x07', passtext):
+            if macros.placeholder_reo.search(passtext):
                 message.warning('nested inline passthrough')
                 return mo.group()
             if d.get('subslist'):
@@ -4032,6 +5041,175 @@ class Macro:
         return self.reo.sub(subs_func, text)
 
 
+class IdRegistry:
+    """
+    Registry of document IDs. Generates unique section IDs and collects
+    explicit anchors and cross reference targets so that dangling cross
+    references can be reported at the end of the run (if the 'check-xrefs'
+    attribute is defined).
+    """
+    def __init__(self):
+        self.generated = set()  # Generated section IDs.
+        self.counters = {}      # Key is base ID, value is next suffix number.
+        self.anchors = set()    # All section, block and inline anchor IDs.
+        self.xrefs = []         # List of (id,cursor) cross references.
+        self.locations = {}     # Key is ID, value is output file name.
+    def generate(self,base_id):
+        """Return unique ID generated from 'base_id' by appending _2, _3...
+        suffixes."""
+        i = self.counters.get(base_id, 1)
+        while True:
+            if i == 1:
+                id = base_id
+            else:
+                id = '%s_%d' % (base_id, i)
+            i += 1
+            if id not in self.generated:
+                break
+        self.counters[base_id] = i
+        self.generated.add(id)
+        self.anchors.add(id)
+        return id
+    def add_anchor(self,id):
+        self.anchors.add(id)
+        self.locations[id] = writer.fname
+    def add_xref(self,id,offset=0):
+        """Register cross reference to 'id' at 'offset' lines from the reader
+        cursor (inline text is substituted after the whole block is read)."""
+        cursor = reader.cursor
+        if cursor:
+            cursor = cursor[:]
+            cursor[1] += offset
+        self.xrefs.append((id,cursor))
+    def validate(self):
+        """Warn about cross references to undefined IDs."""
+        if 'check-xrefs' not in document.attributes:
+            return
+        for id,cursor in self.xrefs:
+            if id not in self.anchors:
+                message.warning('dangling cross reference: %s' % id,
+                        linenos=cursor is not None, cursor=cursor)
+
+class Chunker:
+    """
+    Splits the output document into separate files (chunks) at sections
+    with levels less than or equal to the 'chunk-level' attribute. The
+    first chunk is the output file, the rest are named like
+    <outfile>-01.html, <outfile>-02.html... Navigation and static TOC
+    placeholders are filled and cross references to other chunks are
+    fixed up when all the chunks have been written.
+    """
+    NAV_PLACEHOLDER = '<!-- chunknav -->'
+    def __init__(self):
+        self.level = None       # Chunk section level (None if not chunking).
+        self.chunks = []        # List of (file name,title) tuples.
+    def initialize(self,outfile):
+        if 'chunk-level' not in document.attributes:
+            return
+        try:
+            level = int(document.attributes['chunk-level'])
+        except ValueError:
+            message.warning('illegal chunk-level attribute: %s'
+                    % document.attributes['chunk-level'])
+            return
+        if outfile == '<stdout>':
+            message.warning('chunked output requires an output file')
+            return
+        for template in ('chunk-header','chunk-footer','chunk-navigation'):
+            if template not in config.sections:
+                message.warning('missing template section: [%s]' % template)
+                return
+        self.level = level
+        self.chunks = [(outfile, None)] # Home page title is the doctitle.
+    def isnext(self):
+        """Return True if the current section title starts a new chunk."""
+        return self.level is not None and Title.level <= self.level
+    def start(self,title):
+        """Close the current chunk and open the next one. Open section end
+        tags are written to the current chunk and discarded."""
+        for i,(level,etag) in enumerate(Section.endtags):
+            writer.write(etag,trace='section close')
+            Section.endtags[i] = (level,[])
+        if config.header_footer:
+            writer.write(config.subs_section('chunk-footer',{}),
+                    trace='chunk footer')
+        writer.close()
+        base,ext = os.path.splitext(self.chunks[0][0])
+        fname = '%s-%02d%s' % (base, len(self.chunks), ext)
+        self.chunks.append((fname,title))
+        writer.open(fname)
+        if config.header_footer:
+            writer.write(self.subs_section('chunk-header',{},{'title':title}),
+                    trace='chunk header')
+    @staticmethod
+    def subs_section(section, d, titles):
+        """Like config.subs_section() but the 'titles' dictionary values are
+        already substituted text, they are inserted after the attribute
+        substitution so braces in them are not read as attribute
+        references."""
+        d = d.copy()
+        for k in titles.keys():
+            d[k] = '\x07%s\x07' % k
+        result = []
+        for line in config.subs_section(section,d):
+            for k,v in titles.items():
+                line = line.replace('\x07%s\x07' % k, v)
+            result.append(line)
+        return result
+    def footer(self):
+        """Return the template name used for the last chunk footer."""
+        if len(self.chunks) > 1:
+            return 'chunk-footer'
+        else:
+            return 'footer'
+    def navigation(self,i):
+        """Return navigation lines for chunk number i."""
+        def title(j):
+            return self.chunks[j][1] or document.attributes.get('doctitle','')
+        d = {'chunk-home': os.path.basename(self.chunks[0][0])}
+        titles = {}
+        if i > 0:
+            d['chunk-prev'] = os.path.basename(self.chunks[i-1][0])
+            titles['chunk-prev-title'] = title(i-1)
+        if i < len(self.chunks)-1:
+            d['chunk-next'] = os.path.basename(self.chunks[i+1][0])
+            titles['chunk-next-title'] = title(i+1)
+        return self.subs_section('chunk-navigation',d,titles)
+    def finish(self):
+        """Fill chunk placeholders and redirect cross references to IDs in
+        other chunks."""
+        if len(self.chunks) < 2:
+            return
+        def subs_href(mo):
+            id = mo.group(1)
+            fname = idregistry.locations.get(id)
+            if fname is None or fname == chunk:
+                return mo.group()
+            return 'href="%s#%s"' % (os.path.basename(fname), id)
+        newline = writer.newline
+        for i,(chunk,title) in enumerate(self.chunks):
+            f = open(chunk,'rb')
+            try:
+                lines = f.read().split(newline)
+            finally:
+                f.close()
+            result = []
+            for line in lines:
+                if line == Chunker.NAV_PLACEHOLDER:
+                    result.extend(self.navigation(i))
+                elif line == Section.TOC_PLACEHOLDER \
+                        and 'toc-static' in document.attributes:
+                    result.extend(Section.toc_lines())
+                else:
+                    result.append(line)
+            s = newline.join(result)
+            s = re.sub(r'href="#([^"]+)"', subs_href, s)
+            f = open(chunk,'wb')
+            try:
+                f.write(s)
+            finally:
+                f.close()
+
 class CalloutMap:
     def __init__(self):
         self.comap = {}         # key = list index, value = callouts list.
@@ -4126,12 +5304,10 @@ class Reader1:
     def close(self):
         self.closefile()
         self.__init__()
-    def read(self, skip=False):
-        """Read next line. Return None if EOF. Expand tabs. Strip trailing
-        white space. Maintain self.next read ahead buffer. If skip=True then
-        conditional exclusion is active (ifdef and ifndef macros)."""
-        # Top up buffer.
-        if len(self.next) <= self.READ_BUFFER_MIN:
+    def fill(self, count=READ_BUFFER_MIN):
+        """Top up the self.next read ahead buffer to more than count lines.
+        Expand tabs. Strip trailing white space."""
+        if len(self.next) <= count:
             s = self.f.readline()
             if s:
                 self._lineno = self._lineno + 1
@@ -4140,11 +5316,16 @@ class Reader1:
                     s = s.expandtabs(self.tabsize)
                 s = s.rstrip()
                 self.next.append([self.fname,self._lineno,s])
-                if len(self.next) > self.READ_BUFFER_MIN:
+                if len(self.next) > count:
                     break
                 s = self.f.readline()
                 if s:
                     self._lineno = self._lineno + 1
+    def read(self, skip=False):
+        """Read next line. Return None if EOF. Expand tabs. Strip trailing
+        white space. Maintain self.next read ahead buffer. If skip=True then
+        conditional exclusion is active (ifdef and ifndef macros)."""
+        Reader1.fill(self)
         # Return first (oldest) buffer entry.
         if len(self.next) > 0:
             self.cursor = self.next[0]
@@ -4255,6 +5436,7 @@ class Reader1:
 class Reader(Reader1):
     """ Wraps (well, sought of) Reader1 class and implements conditional text
     inclusion."""
+    VERBATIM_BUFFER_MIN = 200   # Read buffer low level for read_verbatim().
     def __init__(self):
         Reader1.__init__(self)
         self.depth = 0          # if nesting depth.
@@ -4411,6 +5593,50 @@ class Reader(Reader1):
                         return tuple(result)
             result.append(s)
         return tuple(result)
+    def read_verbatim(self,terminator):
+        """Fast version of read_until(terminator,same_file=True) for verbatim
+        block bodies. Lines that are not system macros (include, ifdef,
+        sys...) cannot be changed by read() so they are taken straight from
+        the read ahead buffer and only tested against the terminator."""
+        if isinstance(terminator,basestring):
+            terminator = re.compile(terminator)
+        fname = self.cursor[0]
+        result = []
+        system = [m for m in macros.macros if m.prefix == '+']
+        while True:
+            if not self.skip and self.fname == fname:
+                Reader1.fill(self, self.VERBATIM_BUFFER_MIN)
+                next = self.next
+                n = len(next)
+                i = 0
+                while i < n:
+                    s = next[i][2]
+                    if terminator.match(s):
+                        break
+                    for m in system:
+                        if m.is_triggered(s) and m.reo.match(s):
+                            break
+                    else:
+                        result.append(s)
+                        i += 1
+                        continue
+                    break
+                if i:
+                    self.cursor = next[i-1]
+                    del next[:i]
+                    if i == n:
+                        continue
+            # Process the next line with the regular reader.
+            if self.eof():
+                break
+            save_cursor = self.cursor
+            s = self.read()
+            if fname == self.cursor[0] and terminator.match(s):
+                self.unread(self.cursor)
+                self.cursor = save_cursor
+                break
+            result.append(s)
+        return tuple(result)
 
 class Writer:
     """Writes lines to output file."""
@@ -4420,6 +5646,8 @@ class Writer:
         self.fname = None                # Output file name.
         self.lines_out = 0               # Number of lines written.
         self.skip_blank_lines = False    # If True don't output blank lines.
+        self.placeholders = {}           # Key is output line, value is func.
+        self.deferred = None             # Output held back by placeholder.
     def open(self,fname,bom=None):
         '''
         bom is optional byte order mark.
@@ -4434,12 +5662,35 @@ class Writer:
         if bom:
             self.f.write(bom)
         self.lines_out = 0
+        self.deferred = None
     def close(self):
+        if self.deferred is not None:
+            self.flush_deferred()
         if self.fname != '<stdout>':
             self.f.close()
+    def defer(self, placeholder, func):
+        """When the 'placeholder' line is written hold back the remaining
+        output; at close the placeholder is replaced by the lines returned
+        by func()."""
+        self.placeholders[placeholder] = func
+    def flush_deferred(self):
+        for item in self.deferred:
+            if callable(item):
+                for line in item():
+                    self.f.write(line + self.newline)
+            else:
+                self.f.write(item)
+        self.deferred = None
     def write_line(self, line=None):
         if not (self.skip_blank_lines and (not line or not line.strip())):
-            self.f.write((line or '') + self.newline)
+            if self.placeholders and line in self.placeholders:
+                if self.deferred is None:
+                    self.deferred = []
+                self.deferred.append(self.placeholders[line])
+            elif self.deferred is not None:
+                self.deferred.append((line or '') + self.newline)
+            else:
+                self.f.write((line or '') + self.newline)
             self.lines_out = self.lines_out + 1
     def write(self,*args,**kwargs):
         """Iterates arguments, writes tuple and list arguments one line per
@@ -4528,11 +5779,18 @@ class Config:
 
         self.tags = {}          # Values contain (stag,etag) tuples.
         self.specialchars = {}  # Values of special character substitutions.
+        self.specialchars_table = None  # Ordered (char,value) replacements.
+        self.specialchars_reo = None    # Fallback single pass matcher.
+        self.specialchars_reverse_reo = None
         self.specialwords = {}  # Name is special word pattern, value is macro.
+        self.specialwords_reos = []     # (reo,literals) special words.
+        self.specialwords_matchers = [] # Combined special words matchers.
         self.replacements = OrderedDict()   # Key is find pattern, value is
                                             #replace pattern.
         self.replacements2 = OrderedDict()
         self.replacements3 = OrderedDict()
+        self.compiled_replacements = {} # Key is replacements section name,
+                                        # value is list of compiled patterns.
         self.specialsections = {} # Name is special section name pattern, value
                                   # is corresponding section name.
         self.quotes = OrderedDict()    # Values contain corresponding tag name.
@@ -4648,6 +5906,8 @@ class Config:
         list of lines.
         Updates 'attrs' with parsed [attributes] section entries.
         """
+        # Cached substitutions are invalidated by configuration changes.
+        subscache.clear()
         # Delete trailing blank lines from sections.
         for k in sections.keys():
             for i in range(len(sections[k])-1,-1,-1):
@@ -4681,6 +5941,7 @@ class Config:
         parse_entries(sections.get('titles',()),d)
         Title.load(d)
         parse_entries(sections.get('specialcharacters',()),self.specialchars,escape_delimiter=False)
+        self.compile_specialchars()
         parse_entries(sections.get('quotes',()),self.quotes)
         self.parse_specialwords()
         self.parse_replacements()
@@ -5016,6 +6277,16 @@ class Config:
             if not self.set_replacement(pat, rep, getattr(self,sect)):
                 raise EAsciiDoc,'[%s] entry in %s is not a valid' \
                     ' regular expression: %s' % (sect,self.fname,pat)
+        self.compile_replacements(sect)
+
+    def compile_replacements(self,sect='replacements'):
+        """Compile the replacements section patterns to a list of
+        (reo,replacement,literals) tuples. A pattern is skipped by
+        subs_replacements() if none of its literals occur in the text."""
+        result = []
+        for pat,rep in getattr(self,sect).items():
+            result.append((re.compile(pat), rep, re_literals(pat)))
+        self.compiled_replacements[sect] = result
 
     @staticmethod
     def set_replacement(pat, rep, replacements):
@@ -5033,8 +6304,14 @@ class Config:
     def subs_replacements(self,s,sect='replacements'):
         """Substitute patterns from self.replacements in 's'."""
         result = s
-        for pat,rep in getattr(self,sect).items():
-            result = re.sub(pat, rep, result)
+        for reo,rep,literals in self.compiled_replacements[sect]:
+            if literals:
+                for literal in literals:
+                    if literal in result:
+                        break
+                else:
+                    continue
+            result = reo.sub(rep, result)
         return result
 
     def parse_specialwords(self):
@@ -5063,6 +6340,87 @@ class Config:
                             'is not a valid regular expression: %s' \
                             % (self.fname,word)
                     self.specialwords[word] = name
+        self.compile_specialwords()
+
+    def compile_specialwords(self):
+        """Compile self.specialwords. Each word is compiled once (long word
+        lists overflow the re module cache) and the words are also joined into
+        combined matchers that are used to skip text containing no special
+        words with a single scan. Consecutive words sharing the same leading
+        inline flags are joined into one alternation (Python limits the number
+        of groups in a pattern so long word lists are split across several
+        matchers); words containing embedded flags or back references are
+        their own matcher. Like compile_replacements() each word is paired
+        with the literals found by re_literals() so subs_specialwords() can
+        skip words that cannot match."""
+        self.specialwords_reos = []
+        matchers = []
+        alternatives = None
+        for word in self.specialwords.keys():
+            reo = re.compile(word)
+            self.specialwords_reos.append((reo,re_literals(word)))
+            mo = re.match(r'^(\(\?[iLmsux]+\))*', word)
+            pat = word[mo.end():]
+            if re.search(r'\(\?[iLmsux]+\)|\\\d|\(\?P=', pat):
+                matchers.append(word)
+                alternatives = None
+                continue
+            if alternatives is None or mo.group() != flags \
+                    or n + reo.groups > 99:
+                flags = mo.group()
+                alternatives = []
+                n = 0
+                matchers.append((flags,alternatives))
+            # Delete named groups to avoid duplicates.
+            alternatives.append('(?:' + re.sub(r'\?P<\S+?>','',pat) + ')')
+            n += reo.groups
+        self.specialwords_matchers = []
+        try:
+            for m in matchers:
+                if isinstance(m,tuple):
+                    m = m[0] + '|'.join(m[1])
+                self.specialwords_matchers.append(re.compile(m))
+        except Exception:
+            # Fall back to scanning for each word in turn.
+            self.specialwords_matchers = [reo for reo,literals
+                                          in self.specialwords_reos]
+
+    def compile_specialchars(self):
+        """Build the special character translation table from
+        self.specialchars.
+        The table is a list of (char,value) pairs ordered so that no character
+        is replaced after a value containing it has been inserted, this allows
+        the substitution to be performed with one str.replace() per special
+        character. If there is no such order (circular values) the table is
+        None and a single pass regular expression is used instead."""
+        table = []
+        pending = self.specialchars.keys()
+        while pending:
+            for k in pending:
+                for j in pending:
+                    if j != k and j in self.specialchars[k]:
+                        break
+                else:
+                    table.append((k,self.specialchars[k]))
+                    pending.remove(k)
+                    break
+            else:
+                table = None
+                break
+        self.specialchars_table = table
+        if self.specialchars:
+            # Longest first so multi-character keys and values match first.
+            keys = sorted(self.specialchars.keys(), key=len, reverse=True)
+            self.specialchars_reo = re.compile('|'.join(map(re.escape,keys)))
+            values = [v for v in self.specialchars.values() if v]
+            values.sort(key=len, reverse=True)
+            if values:
+                self.specialchars_reverse_reo = re.compile(
+                        '|'.join(map(re.escape,values)))
+            else:
+                self.specialchars_reverse_reo = None
+        else:
+            self.specialchars_reo = self.specialchars_reverse_reo = None
 
     def subs_specialchars(self,s):
         """Perform special character substitution on string 's'."""
@@ -5070,24 +6428,39 @@ class Config:
         character, the reason we don't is because the escape character itself
         then has to be escaped and this makes including code listings
         problematic. Use the predefined {amp},{lt},{gt} attributes instead."""
-        result = ''
-        for ch in s:
-            result = result + self.specialchars.get(ch,ch)
-        return result
+        if self.specialchars_table is not None:
+            for k,v in self.specialchars_table:
+                s = s.replace(k,v)
+            return s
+        return self.specialchars_reo.sub(
+                lambda mo: self.specialchars[mo.group()], s)
 
     def subs_specialchars_reverse(self,s):
         """Perform reverse special character substitution on string 's'."""
-        result = s
+        if not self.specialchars_reverse_reo:
+            return s
+        d = {}
         for k,v in self.specialchars.items():
-            result = result.replace(v, k)
-        return result
+            d[v] = k
+        return self.specialchars_reverse_reo.sub(lambda mo: d[mo.group()], s)
 
     def subs_specialwords(self,s):
         """Search for word patterns from self.specialwords in 's' and
         substitute using corresponding macro."""
+        for reo in self.specialwords_matchers:
+            if reo.search(s):
+                break
+        else:
+            return s    # No special words.
         result = s
-        for word in self.specialwords.keys():
-            result = re.sub(word, _subs_specialwords, result)
+        for reo,literals in self.specialwords_reos:
+            if literals:
+                for literal in literals:
+                    if literal in result:
+                        break
+                else:
+                    continue
+            result = reo.sub(_subs_specialwords, result)
         return result
 
     def expand_templates(self,entries):
@@ -5882,6 +7255,10 @@ tables_OLD = Tables_OLD()   # Table_OLD definitions.
 tables = Tables()           # Table definitions.
 macros = Macros()           # Macro definitions.
 calloutmap = CalloutMap()   # Coordinates callouts and callout list.
+idregistry = IdRegistry()   # Section ID generation and cross references.
+chunker = Chunker()         # Chunked output.
+subscache = SubsCache()     # Optional Lex.subs() results cache.
+syscache = SysCache()       # System attributes results cache.
 trace = Trace()             # Implements trace attribute processing.
 
 ### Used by asciidocapi.py ###
@@ -5984,6 +7361,10 @@ def asciidoc(backend, doctype, confiles, infile, outfile, options):
         attrs.update(config.cmd_attrs)
         if 'title' in attrs:    # Don't pass the header title.
             del attrs['title']
+        # Filtered fragments are not documents and are written to stdout.
+        for k in ('check-xrefs','chunk-level','toc-static'):
+            if k in attrs:
+                del attrs[k]
         for k,v in attrs.items():
             if v:
                 args += ' --attribute "%s=%s"' % (k,v)
@@ -6017,12 +7398,19 @@ def asciidoc(backend, doctype, confiles, infile, outfile, options):
             config.dump()
         else:
             writer.newline = config.newline
+            chunker.initialize(outfile)
+            if 'toc-static' in document.attributes and chunker.level is None:
+                writer.defer(Section.TOC_PLACEHOLDER, Section.toc_lines)
             try:
                 writer.open(outfile, reader.bom)
                 try:
                     document.translate(has_header) # Generate the output.
                 finally:
                     writer.close()
+                chunker.finish()
+                subscache.report()
+                syscache.save()
+                idregistry.validate()
             finally:
                 reader.closefile()
     except KeyboardInterrupt:
@@ -6031,6 +7419,9 @@ def asciidoc(backend, doctype, confiles, infile, outfile, options):
         # Cleanup.
         if outfile and outfile != '<stdout>' and os.path.isfile(outfile):
             os.unlink(outfile)
+        for fname,title in chunker.chunks[1:]:
+            if os.path.isfile(fname):
+                os.unlink(fname)
         # Build and print error description.
         msg = 'FAILED: '
         if reader.cursor:
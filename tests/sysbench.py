@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+USAGE = '''Usage: sysbench.py [OPTIONS]
+
+Compare the throughput of reading system attribute ({sys:...}) command
+output from a temporary file (the previous implementation) and from a pipe
+(asciidoc.py shell(), without and with a 'sys-timeout').
+
+Options:
+  -a, --asciidoc=ASCIIDOC_PY
+        Use shell() from ASCIIDOC_PY (default is asciidoc.py in the parent of
+        the sysbench.py directory)
+  -n, --count=COUNT
+        Number of commands executed by each method (default is 300)
+  -l, --lines=LINES
+        Number of output lines written by each command (default is 1)'''
+
+
+__version__ = '0.1.0'
+
+
+import os, sys, time, tempfile, imp
+
+
+def message(msg=''):
+    print >>sys.stderr, msg
+
+def read_tempfile(cmd):
+    """
+    Return the lines output by shell command 'cmd', redirected to a temporary
+    file with os.system() and read back.
+    """
+    fd,tmp = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        os.system('%s > "%s"' % (cmd, tmp))
+        f = open(tmp)
+        try:
+            return [s.rstrip() for s in f]
+        finally:
+            f.close()
+    finally:
+        os.remove(tmp)
+
+def read_pipe(shell, timeout=None):
+    """
+    Return a function that returns the lines output by a shell command read
+    from a pipe by the asciidoc.py 'shell' function.
+    """
+    def read(cmd):
+        output = shell(cmd, timeout=timeout)[0]
+        return [s.rstrip() for s in output.splitlines()]
+    return read
+
+def run(asciidoc, count, lines):
+    module = imp.load_source('asciidoc', asciidoc)
+    cmd = 'echo "output line"'
+    if lines > 1:
+        cmd = 'for i in %s; do %s; done' % (' '.join(['x']*lines), cmd)
+    expected = ['output line'] * lines
+    for title, read in (('temp file', read_tempfile),
+                        ('pipe', read_pipe(module.shell)),
+                        ('pipe with timeout', read_pipe(module.shell, 60))):
+        start = time.time()
+        for i in range(count):
+            if read(cmd) != expected:
+                raise RuntimeError('%s: unexpected output' % title)
+        elapsed = time.time() - start
+        print('%d commands, %d lines, %s: %.2fs (%.1f ms/command)' %
+              (count, lines, title, elapsed, elapsed*1000/count))
+
+
+def usage(msg=None):
+    if msg:
+        message(msg + '\n')
+    message(USAGE)
+
+
+if __name__ == '__main__':
+    # Process command line options.
+    import getopt
+    try:
+        opts,args = getopt.getopt(sys.argv[1:], 'a:n:l:',
+                ['asciidoc=', 'count=', 'lines='])
+    except getopt.GetoptError:
+        usage('illegal command options')
+        sys.exit(1)
+    if args:
+        usage()
+        sys.exit(1)
+    asciidoc = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])),
+                            '..', 'asciidoc.py')
+    count, lines = 300, 1
+    try:
+        for o,v in opts:
+            if o in ('-a','--asciidoc'):
+                asciidoc = v
+            if o in ('-n','--count'):
+                count = int(v)
+            if o in ('-l','--lines'):
+                lines = int(v)
+    except ValueError:
+        usage('illegal number: %s' % v)
+        sys.exit(1)
+    if count < 1 or lines < 1:
+        usage('COUNT and LINES must be positive')
+        sys.exit(1)
+    if not os.path.isfile(asciidoc):
+        message('missing ASCIIDOC_PY: %s' % asciidoc)
+        sys.exit(1)
+    run(os.path.normpath(asciidoc), count, lines)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+USAGE = '''Usage: tableparse.py [OPTIONS]
+
+Time the PSV table parsing methods (Table.parse_psv_dsv() and
+Table.parse_rows()) of an asciidoc run that translates a wide generated table
+with row spans and escaped separators, and of one that translates a single
+cell containing many escaped separators.
+
+Options:
+  -a, --asciidoc=ASCIIDOC_PY
+        Time ASCIIDOC_PY (default is asciidoc.py in the parent of the
+        tableparse.py directory)
+  -r, --rows=ROWS
+        Number of table rows (default is 2000, rounded up to a multiple of
+        the row span)
+  -c, --cols=COLS
+        Number of table columns (default is 50)
+  -s, --span=SPAN
+        Spanned cells start every SPAN rows in every fifth column (default
+        is 4)
+  -e, --escapes=ESCAPES
+        Number of escaped separators in the single cell table (default is
+        100000)'''
+
+
+__version__ = '0.1.0'
+
+
+import os, sys, time, tempfile, shutil, imp
+
+from tablerss import table_source
+
+
+def message(msg=''):
+    print >>sys.stderr, msg
+
+def timed(timings, name, func):
+    """
+    Return a wrapper for 'func' that adds its elapsed time to
+    timings[name].
+    """
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[name] = timings.get(name, 0) + time.time() - start
+    return wrapper
+
+def translate(module, asciidoc, source, tmpdir):
+    """
+    Translate AsciiDoc 'source' text and return a dictionary of the elapsed
+    times of the parsing methods and of the whole run.
+    """
+    infile = os.path.join(tmpdir, 'table.txt')
+    f = open(infile, 'w')
+    try:
+        f.write(source)
+    finally:
+        f.close()
+    timings = {}
+    Table = module.Table
+    saved = {}
+    for name in ('parse_psv_dsv', 'parse_rows'):
+        saved[name] = Table.__dict__[name]
+        setattr(Table, name, timed(timings, name, saved[name]))
+    try:
+        start = time.time()
+        module.execute(asciidoc,
+                [('--out-file', os.path.join(tmpdir, 'table.html'))],
+                [infile])
+        timings['run'] = time.time() - start
+    finally:
+        for name,func in saved.items():
+            setattr(Table, name, func)
+    return timings
+
+def run(asciidoc, rows, cols, span, escapes):
+    if rows % span:
+        rows += span - rows % span
+    module = imp.load_source('asciidoc', asciidoc)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for title, source in (
+                ('%dx%d table, %d-row spans, escapes' % (rows, cols, span),
+                    table_source(rows, cols, span, escapes=True)),
+                ('single cell, %d escapes' % escapes,
+                    'Table\n=====\n\n[cols="1"]\n|===\n|%s\n|===\n'
+                    % ('x\\|' * escapes))):
+            timings = translate(module, asciidoc, source, tmpdir)
+            print('%s: parse_psv_dsv %.2fs, parse_rows %.2fs, run %.2fs' %
+                  (title, timings.get('parse_psv_dsv', 0),
+                   timings.get('parse_rows', 0), timings['run']))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def usage(msg=None):
+    if msg:
+        message(msg + '\n')
+    message(USAGE)
+
+
+if __name__ == '__main__':
+    # Process command line options.
+    import getopt
+    try:
+        opts,args = getopt.getopt(sys.argv[1:], 'a:r:c:s:e:',
+                ['asciidoc=', 'rows=', 'cols=', 'span=', 'escapes='])
+    except getopt.GetoptError:
+        usage('illegal command options')
+        sys.exit(1)
+    if args:
+        usage()
+        sys.exit(1)
+    asciidoc = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])),
+                            '..', 'asciidoc.py')
+    rows, cols, span, escapes = 2000, 50, 4, 100000
+    try:
+        for o,v in opts:
+            if o in ('-a','--asciidoc'):
+                asciidoc = v
+            if o in ('-r','--rows'):
+                rows = int(v)
+            if o in ('-c','--cols'):
+                cols = int(v)
+            if o in ('-s','--span'):
+                span = int(v)
+            if o in ('-e','--escapes'):
+                escapes = int(v)
+    except ValueError:
+        usage('illegal number: %s' % v)
+        sys.exit(1)
+    if rows < 1 or cols < 1 or span < 1 or escapes < 1:
+        usage('ROWS, COLS, SPAN and ESCAPES must be positive')
+        sys.exit(1)
+    if not os.path.isfile(asciidoc):
+        message('missing ASCIIDOC_PY: %s' % asciidoc)
+        sys.exit(1)
+    run(os.path.abspath(asciidoc), rows, cols, span, escapes)
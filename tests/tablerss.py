@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+USAGE = '''Usage: tablerss.py [OPTIONS]
+
+Measure the peak resident set size of asciidoc runs that translate a large
+generated table, once without and once with row spans.
+
+Options:
+  -a, --asciidoc=ASCIIDOC_PY
+        Run ASCIIDOC_PY (default is asciidoc.py in the parent of the
+        tablerss.py directory)
+  -b, --backend=BACKEND
+        Output BACKEND (default is xhtml11)
+  -r, --rows=ROWS
+        Number of table rows (default is 1000, rounded up to a multiple of
+        the row span)
+  -c, --cols=COLS
+        Number of table columns (default is 50)
+  -s, --span=SPAN
+        Spanned cells start every SPAN rows in every fifth column (default
+        is 4)'''
+
+
+__version__ = '0.1.0'
+
+
+import os, sys, tempfile, shutil, subprocess
+
+
+# Runs ASCIIDOC_PY in a child process and prints its peak RSS in kilobytes.
+# Each measurement is made by a new process because RUSAGE_CHILDREN reports
+# the largest of all the terminated children.
+MEASURE = '''
+import resource, subprocess, sys
+if subprocess.call(sys.argv[1:]) != 0:
+    sys.exit(1)
+rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+if sys.platform == 'darwin':
+    rss = rss / 1024    # Reported in bytes.
+print(rss)
+'''
+
+
+def message(msg=''):
+    print >>sys.stderr, msg
+
+def table_source(rows, cols, span=None, escapes=False):
+    """
+    Return the AsciiDoc source of a PSV table with 'rows' rows and 'cols'
+    columns. If 'span' is not None cells in every fifth column span 'span'
+    rows. If 'escapes' is True every cell contains an escaped separator.
+    """
+    result = ['Table RSS', '=========', '', '[cols="%d*"]' % cols, '|===']
+    escape = escapes and '\\|' or ''
+    for r in range(rows):
+        line = []
+        for c in range(cols):
+            if span and c % 5 == 0:
+                if r % span == 0:
+                    line.append('.%d+|r%dc%d%s' % (span, r, c, escape))
+            else:
+                line.append('|r%dc%d%s' % (r, c, escape))
+        result.append(' '.join(line))
+    result.append('|===')
+    return '\n'.join(result) + '\n'
+
+def peak_rss(asciidoc, backend, infile, outfile):
+    """
+    Return the peak RSS (in kilobytes) of an asciidoc run translating
+    'infile' to 'outfile'.
+    """
+    cmd = [sys.executable, '-c', MEASURE, sys.executable, asciidoc,
+           '-b', backend, '-o', outfile, infile]
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    output = p.communicate()[0]
+    if p.returncode != 0:
+        raise RuntimeError('asciidoc failed: %s' % infile)
+    return int(output.strip())
+
+def run(asciidoc, backend, rows, cols, span):
+    if rows % span:
+        rows += span - rows % span
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for title, s in (('no spans', None),
+                         ('%d-row spans' % span, span)):
+            infile = os.path.join(tmpdir, 'table.txt')
+            f = open(infile, 'w')
+            try:
+                f.write(table_source(rows, cols, s))
+            finally:
+                f.close()
+            rss = peak_rss(asciidoc, backend, infile,
+                           os.path.join(tmpdir, 'table.out'))
+            print('%dx%d table, %s: %.1f MB' % (rows, cols, title, rss/1024.0))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def usage(msg=None):
+    if msg:
+        message(msg + '\n')
+    message(USAGE)
+
+
+if __name__ == '__main__':
+    # Process command line options.
+    import getopt
+    try:
+        opts,args = getopt.getopt(sys.argv[1:], 'a:b:r:c:s:',
+                ['asciidoc=', 'backend=', 'rows=', 'cols=', 'span='])
+    except getopt.GetoptError:
+        usage('illegal command options')
+        sys.exit(1)
+    if args:
+        usage()
+        sys.exit(1)
+    asciidoc = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])),
+                            '..', 'asciidoc.py')
+    backend = 'xhtml11'
+    rows, cols, span = 1000, 50, 4
+    try:
+        for o,v in opts:
+            if o in ('-a','--asciidoc'):
+                asciidoc = v
+            if o in ('-b','--backend'):
+                backend = v
+            if o in ('-r','--rows'):
+                rows = int(v)
+            if o in ('-c','--cols'):
+                cols = int(v)
+            if o in ('-s','--span'):
+                span = int(v)
+    except ValueError:
+        usage('illegal number: %s' % v)
+        sys.exit(1)
+    if rows < 1 or cols < 1 or span < 1:
+        usage('ROWS, COLS and SPAN must be positive')
+        sys.exit(1)
+    if not os.path.isfile(asciidoc):
+        message('missing ASCIIDOC_PY: %s' % asciidoc)
+        sys.exit(1)
+    run(os.path.normpath(asciidoc), backend, rows, cols, span)
@@ -22,7 +22,7 @@ __copyright__ = 'Copyright (C) 2009 Stuart Rackham'
 
 
 import os, sys, re, difflib
-import time
+import time, tempfile, shutil
 
 if sys.platform[:4] == 'java':
     # Jython cStringIO is more compatible with CPython StringIO.
@@ -111,6 +111,7 @@ class AsciiDocTest(object):
         self.backends = BACKENDS
         self.datadir = None     # Where output files are stored.
         self.disabled = False
+        self.messages = False   # Append asciidoc messages to output.
 
     def backend_filename(self, backend):
         """
@@ -161,6 +162,8 @@ class AsciiDocTest(object):
                     self.backends = eval(' '.join(data))
                 elif directive == 'name':
                     self.name = data[0].strip()
+                elif directive == 'messages':
+                    self.messages = eval(' '.join(data))
                 else:
                     raise (ValueError, 'illegal directive: %s' % l[0])
         if not self.title:
@@ -204,9 +207,37 @@ class AsciiDocTest(object):
         asciidoc.options.values = self.options
         asciidoc.attributes = self.attributes
         infile = self.source
-        outfile = StringIO.StringIO()
-        asciidoc.execute(infile, outfile, backend)
-        return outfile.getvalue().splitlines()
+        if 'chunk-level' in self.attributes:
+            result = self.generate_chunked(asciidoc, infile, backend)
+        else:
+            outfile = StringIO.StringIO()
+            asciidoc.execute(infile, outfile, backend)
+            result = outfile.getvalue().splitlines()
+        if self.messages:
+            result.append('### messages')
+            result += asciidoc.messages
+        return result
+
+    def generate_chunked(self, asciidoc, infile, backend):
+        """
+        Chunked output needs an output file so it is written to a temporary
+        directory and the main file and its chunk files, in that order, are
+        returned as a single list of lines each preceded by a '### FILE' line.
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outfile = os.path.join(tmpdir, self.name + BACKEND_EXT[backend])
+            asciidoc.execute(infile, outfile, backend)
+            chunks = [ f for f in os.listdir(tmpdir)
+                    if f != os.path.basename(outfile) ]
+            chunks.sort()
+            result = []
+            for f in [os.path.basename(outfile)] + chunks:
+                result.append('### %s' % f)
+                result += [ s.rstrip() for s in open(os.path.join(tmpdir,f)) ]
+            return result
+        finally:
+            shutil.rmtree(tmpdir)
 
     def update_expected(self, backend):
         """